@@ -1,13 +1,19 @@
 from langchain_ollama import OllamaLLM
 from langchain_core.prompts import ChatPromptTemplate
+from tokens import count_tokens
+from llm_cache import get_llm_cache
+from ollama_client import get_ollama_client, get_ollama_pool, is_backend_failure, configured_hosts, call_deadline
+from scheduler import get_llm_scheduler, PRIORITY_INTERACTIVE
 import datetime
 import logging
 import time
-import requests
+import httpx
 import threading
 import json
 import re
 import os
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
 import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 
@@ -221,73 +227,226 @@ Use realistic values based on your analysis. This JSON will be used to create vi
 class TimeoutException(Exception):
     pass
 
-# Cross-platform timeout implementation
-class Timeout:
-    def __init__(self, seconds):
+# Time budget shared by the LLM calls of one report; calls stop streaming once it has passed
+class Deadline:
+    def __init__(self, seconds=None):
         self.seconds = seconds
-        self.timeout_happened = False
-        self._timer = None
+        self.expires_at = time.monotonic() + seconds if seconds is not None else None
+    
+    def remaining(self):
+        if self.expires_at is None:
+            return float("inf")
+        return max(0.0, self.expires_at - time.monotonic())
+    
+    def expired(self):
+        return self.remaining() <= 0
+    
+    def cap(self, seconds):
+        """Return a deadline ending after seconds, or at this deadline if that comes first"""
+        if self.expires_at is None:
+            return Deadline(seconds)
+        if seconds is None:
+            return Deadline(self.remaining())
+        return Deadline(min(seconds, self.remaining()))
+
+# Upper bound for num_ctx when the model supports more; larger windows cost GPU memory
+DEFAULT_MAX_CONTEXT = int(os.environ.get("OLLAMA_MAX_CONTEXT", 8192))
+# Tokens kept free in the context window for the model's answer
+OUTPUT_TOKEN_RESERVE = 1024
+# Concurrent chunk requests; OLLAMA_NUM_PARALLEL per server so requests don't just queue
+DEFAULT_MAX_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 1)) * len(configured_hosts())
+# Analyses merged per intermediate consolidation call; above this count consolidation becomes a tree
+DEFAULT_CONSOLIDATION_FAN_IN = int(os.environ.get("CONSOLIDATION_FAN_IN", 6))
+# Longest wait for the next streamed token before the HTTP request is dropped (covers prompt evaluation)
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", 120))
+# End-to-end time budget for one report in seconds across chunks and consolidation; 0 means no budget
+DEFAULT_REPORT_BUDGET = float(os.environ.get("REPORT_TIME_BUDGET", 0))
+# Share of the report budget that chunk analysis may use; the rest is kept for consolidation
+CHUNK_BUDGET_SHARE = 0.75
+
+_context_length_cache = {}
+
+def set_llm_concurrency(limit):
+    """Limit concurrent LLM calls across every report in this process (None or 0 removes the limit); returns the previous limit"""
+    return get_llm_scheduler().set_limit(limit)
+
+@contextmanager
+def _llm_slot(llm_job=None, cancel=None, deadline=None):
+    """Hold one LLM slot from the process-wide scheduler, queued fairly against other reports
+
+    Waiting gives up with CancelledError when cancel is set, or TimeoutException when the deadline passes.
+    """
+    scheduler = get_llm_scheduler()
+    wait = deadline.remaining() if deadline is not None and deadline.expires_at is not None else None
+    try:
+        scheduler.acquire(llm_job, cancel, wait)
+    except TimeoutError as e:
+        raise TimeoutException(f"Report time budget exhausted while queued: {str(e)}") from e
+    try:
+        yield
+    finally:
+        scheduler.release()
+
+class _AnyEvent:
+    """Read-only view that is set when any of several threading.Events is set"""
+    def __init__(self, *events):
+        self.events = events
+    
+    def is_set(self):
+        return any(event.is_set() for event in self.events)
+
+def get_model_context_length(model_name, default=4096):
+    """Return the context length the model was trained with, from Ollama's /api/show"""
+    if model_name in _context_length_cache:
+        return _context_length_cache[model_name]
+    
+    try:
+        response = get_ollama_client(model_name).post("/api/show", json={"model": model_name})
+        if response.status_code == 200:
+            model_info = response.json().get("model_info", {})
+            for key, value in model_info.items():
+                if key.endswith(".context_length"):
+                    _context_length_cache[model_name] = int(value)
+                    return int(value)
+        logger.warning(f"Could not read context length for {model_name}; assuming {default}")
+    except httpx.HTTPError as e:
+        logger.warning(f"Could not query model info for {model_name}: {str(e)}")
+    return default
+
+def get_context_window(model_name):
+    """num_ctx to run the model with: OLLAMA_NUM_CTX if set, else the model's context length capped at DEFAULT_MAX_CONTEXT"""
+    if os.environ.get("OLLAMA_NUM_CTX"):
+        return int(os.environ["OLLAMA_NUM_CTX"])
+    return min(get_model_context_length(model_name), DEFAULT_MAX_CONTEXT)
+
+def select_template(industry):
+    """Return the analysis prompt template for an industry"""
+    if industry == "Healthcare":
+        return healthcare_template
+    elif industry == "Finance":
+        return finance_template
+    return generic_template
+
+def build_invoke_params(chunk, industry, analysis_type, time_period, detail_level, custom_prompt=""):
+    """Build the template variables for analysing one content chunk"""
+    invoke_params = {
+        "dom_content": chunk,
+        "analysis_type": analysis_type,
+        "time_period": time_period,
+        "detail_level": detail_level,
+        "custom_prompt": custom_prompt
+    }
+    # The healthcare and finance templates have the industry baked in
+    if industry != "Healthcare" and industry != "Finance":
+        invoke_params["industry"] = industry
+    return invoke_params
+
+def get_chunk_token_budget(model_name, industry, analysis_type="", time_period="", detail_level="",
+                           custom_prompt="", num_ctx=None, output_reserve=OUTPUT_TOKEN_RESERVE):
+    """Tokens of source content that fit in one analysis prompt for this model and template"""
+    num_ctx = num_ctx or get_context_window(model_name)
+    prompt = ChatPromptTemplate.from_template(select_template(industry))
+    overhead = count_tokens(prompt.format(**build_invoke_params(
+        "", industry, analysis_type, time_period, detail_level, custom_prompt
+    )))
+    budget = num_ctx - overhead - output_reserve
+    if budget < 256:
+        logger.warning(f"Context window {num_ctx} leaves only {budget} tokens for content; using 256")
+        budget = 256
+    logger.info(f"Chunk token budget for {model_name}: {budget} (num_ctx {num_ctx}, template {overhead}, reserve {output_reserve})")
+    return budget
+
+# Models tried, in order, after the requested one
+FALLBACK_MODELS = ["llama3:latest", "llama2:latest", "mistral:latest"]
+
+class ModelRegistry:
+    """Process-wide cache of initialised OllamaLLM models and the servers' model list
+
+    Models are created once per (name, num_ctx, server) and reused; the /api/tags list is
+    refreshed at most every tags_ttl seconds. Entries are only re-validated after
+    invalidate() is called, which the analysis path does when a model call fails.
+    """
+    def __init__(self, tags_ttl=60):
+        self.tags_ttl = tags_ttl
+        self._lock = threading.Lock()
+        self._models = {}
+        self._tags = None
+        self._tags_fetched_at = 0.0
+
+    def available_models(self, refresh=False):
+        """Return model names installed on any healthy server; raises httpx.HTTPError if none is reachable"""
+        with self._lock:
+            if not refresh and self._tags is not None and time.monotonic() - self._tags_fetched_at < self.tags_ttl:
+                return list(self._tags)
+            refresh = refresh or self._tags is None
         
-    def _timeout_function(self):
-        self.timeout_happened = True
+        tags = get_ollama_pool().available_models(refresh=refresh)
         
-    def __enter__(self):
-        self._timer = threading.Timer(self.seconds, self._timeout_function)
-        self._timer.daemon = True
-        self._timer.start()
-        return self
+        with self._lock:
+            self._tags = tags
+            self._tags_fetched_at = time.monotonic()
+        logger.info(f"Available Ollama models: {tags}")
+        return list(tags)
+
+    def resolve(self, model_name, refresh=False):
+        """Pick the first of model_name and FALLBACK_MODELS that the server has installed"""
+        available_bases = {m.split(':')[0] for m in self.available_models(refresh=refresh)}
+        for candidate in [model_name] + FALLBACK_MODELS:
+            if candidate.split(':')[0] in available_bases:
+                if candidate != model_name:
+                    logger.warning(f"Model {model_name} not found in available models; using {candidate}")
+                return candidate
+        raise Exception("All model options failed. Check if Ollama is running and has models installed.")
+
+    def get(self, model_name, num_ctx=None, backend=None):
+        """Return a warm OllamaLLM for model_name on backend (default: the least busy server), creating it on first use"""
+        key = (model_name, num_ctx, backend.client.base_url if backend is not None else None)
+        with self._lock:
+            model = self._models.get(key)
+        if model is not None:
+            return model
         
-    def __exit__(self, exc_type, exc_val, exc_tb):
-        if self._timer:
-            self._timer.cancel()
+        resolved = self.resolve(model_name)
+        client = backend.client if backend is not None else get_ollama_client(resolved)
+        logger.info(f"Initializing Ollama with model: {resolved} on {client.base_url}")
+        model = OllamaLLM(model=resolved, num_ctx=num_ctx, **client.llm_kwargs(OLLAMA_READ_TIMEOUT))
+        with self._lock:
+            return self._models.setdefault(key, model)
+
+    def invalidate(self, model_name=None):
+        """Forget cached models (one name or all) and the tag list so the next call re-validates"""
+        with self._lock:
+            if model_name is None:
+                self._models.clear()
+            else:
+                for key in [key for key in self._models if key[0] == model_name]:
+                    del self._models[key]
+            self._tags = None
+
+_model_registry = ModelRegistry()
+
+def get_model_registry():
+    return _model_registry
 
-def create_ollama_model(model_name="llama3:latest", retries=3, backoff=2):
-    """Create OllamaLLM model with retry logic"""
+# Prompt for intermediate merges in tree consolidation; the final consolidation adds the report structure and JSON
+merge_template = """
+You are a senior industry analyst specializing in {industry} markets.
+
+Below are partial analyses of {industry} industry sources. Merge them into one analysis with the same
+markdown sections (Key Market Trends, Emerging Technologies, Regulatory Landscape, Funding Environment,
+Competitive Analysis, Market Opportunities, Strategic Recommendations). Remove duplicates, but keep
+specific companies, figures and supporting evidence. Do not add a JSON block.
+
+{combined_analysis}
+"""
+
+def create_ollama_model(model_name="llama3:latest", retries=3, backoff=2, num_ctx=None):
+    """Return a cached OllamaLLM model from the registry, retrying with a fresh tag list on failure"""
     for attempt in range(retries):
         try:
-            # Try with different models if available
-            model_options = [model_name, "llama3:latest", "llama2:latest", "mistral:latest"]
-            
-            for model_name in model_options:
-                try:
-                    logger.info(f"Attempting to initialize Ollama with model: {model_name}")
-                    
-                    # Check if Ollama server is running
-                    try:
-                        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-                        if response.status_code == 200:
-                            available_models = [model["name"] for model in response.json().get("models", [])]
-                            logger.info(f"Available Ollama models: {available_models}")
-                            
-                            if model_name.split(':')[0] not in [m.split(':')[0] for m in available_models]:
-                                logger.warning(f"Model {model_name} not found in available models")
-                                continue
-                        else:
-                            logger.warning(f"Ollama API returned status code {response.status_code}")
-                            raise Exception("Ollama API is not responding correctly")
-                    except requests.exceptions.RequestException as e:
-                        logger.error(f"Cannot connect to Ollama server: {str(e)}")
-                        raise Exception("Cannot connect to Ollama server - please ensure it's running")
-                    
-                    # Initialize the model
-                    model = OllamaLLM(model=model_name)
-                    
-                    # Test the model with a simple prompt
-                    test_result = model.invoke("Hello")
-                    if test_result and len(test_result) > 0:
-                        logger.info(f"Successfully initialized Ollama with model: {model_name}")
-                        return model
-                    else:
-                        logger.warning(f"Model {model_name} returned empty response")
-                        continue
-                    
-                except Exception as e:
-                    logger.warning(f"Failed to initialize model {model_name}: {str(e)}")
-                    continue
-            
-            raise Exception("All model options failed. Check if Ollama is running and has models installed.")
-            
+            return _model_registry.get(model_name, num_ctx=num_ctx)
         except Exception as e:
+            _model_registry.invalidate(model_name)
             if attempt < retries - 1:
                 sleep_time = backoff ** attempt
                 logger.warning(f"Attempt {attempt+1} failed: {str(e)}. Retrying in {sleep_time} seconds...")
@@ -398,7 +557,15 @@ def debug_json_extraction(text):
                 })
     
     return results
+# pyplot keeps global figure state, so reports generated concurrently must not draw at the same time
+_plot_lock = threading.Lock()
+
 def generate_visualizations(data, industry, output_dir="visualizations"):
+    """Generate visualizations from the extracted data; safe to call from several threads"""
+    with _plot_lock:
+        return _generate_visualizations(data, industry, output_dir)
+
+def _generate_visualizations(data, industry, output_dir="visualizations"):
     """Generate visualizations from the extracted data with improved error handling"""
     if not data:
         logger.warning("No visualization data provided")
@@ -560,33 +727,210 @@ def clean_analysis_text(text):
     cleaned_text = cleaned_text.replace("<", "&lt;").replace(">", "&gt;")
     return cleaned_text
 
-def analyze_trends_with_ollama(dom_chunks, industry, analysis_type, time_period, detail_level, model="llama3:latest", timeout=180, custom_prompt=""):
-    """Analyze industry trends from content chunks using Ollama LLM"""
-    analysis_params = {
-        "industry": industry,
-        "analysis_type": analysis_type,
-        "time_period": time_period,
-        "detail_level": detail_level,
-        "custom_prompt": custom_prompt if custom_prompt else ""
-    }
+def _stream_until(prompt, model_name, params, num_ctx=None, deadline=None, cancel=None):
+    """Stream (prompt | model).stream(params) from the least busy server with the model, stopped when the deadline passes or the cancel event is set
+
+    Stopping closes the HTTP connection; Ollama then aborts the generation and frees the slot
+    instead of finishing an answer nobody will read. The connection is closed by a watchdog
+    (see ollama_client.call_deadline), so this also happens while the prompt is evaluated
+    or a stream stalls. A server that fails before sending anything is marked down and the
+    call fails over to the next one; once text has been streamed the error is raised instead.
+    """
+    pool = get_ollama_pool()
+    # Route by the model that will actually run, which may be a fallback only some servers have
+    model_name = _model_registry.resolve(model_name)
+    tried = []
+    while True:
+        with pool.backend(model_name, exclude=tried) as backend:
+            stream = (prompt | _model_registry.get(model_name, num_ctx, backend)).stream(params)
+            started = False
+            try:
+                while True:
+                    with call_deadline(deadline, cancel):
+                        piece = next(stream, None)
+                    if cancel is not None and cancel.is_set():
+                        raise CancelledError("Analysis was cancelled")
+                    if deadline is not None and deadline.expired():
+                        raise TimeoutException(f"Timed out after {deadline.seconds:.0f} seconds")
+                    if piece is None:
+                        break
+                    started = True
+                    yield piece
+                return
+            except (CancelledError, TimeoutException):
+                raise
+            except Exception as e:
+                # The watchdog closing the connection surfaces as a transport error
+                if cancel is not None and cancel.is_set():
+                    raise CancelledError("Analysis was cancelled") from e
+                if deadline is not None and deadline.expired():
+                    raise TimeoutException(f"Timed out after {deadline.seconds:.0f} seconds") from e
+                if not is_backend_failure(e):
+                    raise
+                pool.mark_failed(backend, e)
+                tried.append(backend)
+                if started or len(tried) >= len(pool.backends):
+                    raise
+                logger.warning("Retrying the call on another Ollama server")
+            finally:
+                stream.close()
+
+def _cached_invoke(prompt, model_name, template, params, num_ctx=None, deadline=None, cancel=None, llm_job=None, timeout=None):
+    """Run prompt | model on params through the persistent LLM response cache and return the whole response"""
+    return "".join(_cached_stream(prompt, model_name, template, params, num_ctx, deadline, cancel, llm_job, timeout))
+
+def _cached_stream(prompt, model_name, template, params, num_ctx=None, deadline=None, cancel=None, llm_job=None, timeout=None):
+    """(prompt | model).stream(params) through the persistent LLM response cache, yielding text pieces
+
+    A cache hit is yielded as a single piece without queueing. On a miss the call waits for
+    a scheduler slot for llm_job until cancel is set or deadline passes; timeout then caps
+    the call itself, counted from when the slot is granted. Only complete responses are cached.
+    """
+    cache = get_llm_cache()
+    key = None
+    if cache is not None:
+        key = cache.make_key(model_name, template, dict(params, num_ctx=num_ctx))
+        cached = cache.get(key)
+        if cached is not None:
+            logger.info(f"LLM response cache hit for {model_name}")
+            yield cached
+            return
     
-    # Select template based on industry
-    if industry == "Healthcare":
-        template = healthcare_template
-    elif industry == "Finance":
-        template = finance_template
-    else:
-        template = generic_template
+    response = []
+    with _llm_slot(llm_job, cancel, deadline):
+        call_limit = deadline.cap(timeout) if deadline is not None else Deadline(timeout)
+        if call_limit.expired():
+            raise TimeoutException("Report time budget exhausted")
+        for piece in _stream_until(prompt, model_name, params, num_ctx, call_limit, cancel):
+            response.append(piece)
+            yield piece
+    
+    response = "".join(response)
+    if cache is not None and response:
+        cache.put(key, model_name, template, response)
+
+def _group_analyses(analyses, fan_in, max_group_tokens=None):
+    """Greedily group analyses, at most fan_in per group and (when given) max_group_tokens per group"""
+    groups = []
+    current = []
+    current_tokens = 0
+    for analysis in analyses:
+        tokens = count_tokens(analysis)
+        if current and (len(current) >= fan_in or (max_group_tokens and current_tokens + tokens > max_group_tokens)):
+            groups.append(current)
+            current = []
+            current_tokens = 0
+        current.append(analysis)
+        current_tokens += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+def _tree_merge(analyses, model_name, industry, fan_in, max_parallel=1, timeout=180, num_ctx=None, deadline=None, llm_job=None, max_tokens=None, cancel=None):
+    """Map-reduce consolidation: merge analyses in groups of at most fan_in, level by level,
+    until fan_in or fewer remain and (when given) they add up to at most max_tokens"""
+    prompt = ChatPromptTemplate.from_template(merge_template)
+    max_group_tokens = (num_ctx or get_context_window(model_name)) - OUTPUT_TOKEN_RESERVE - count_tokens(merge_template)
+    if max_group_tokens <= 0:
+        max_group_tokens = None
+    
+    def merge(group):
+        if len(group) == 1:
+            return group[0]
+        params = {"combined_analysis": "\n\n".join(group), "industry": industry}
+        try:
+            return _cached_invoke(prompt, model_name, merge_template, params, num_ctx, deadline, cancel, llm_job, timeout)
+        except CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Merging {len(group)} analyses failed ({str(e)}); passing them up unmerged")
+            return params["combined_analysis"]
+    
+    def too_large(analyses):
+        return max_tokens is not None and len(analyses) > 1 and sum(count_tokens(a) for a in analyses) > max_tokens
     
+    level = 0
+    while len(analyses) > fan_in or too_large(analyses):
+        groups = _group_analyses(analyses, fan_in, max_group_tokens)
+        if len(groups) == len(analyses):
+            logger.warning("Analyses are too large to merge within the context window; stopping tree consolidation")
+            break
+        level += 1
+        logger.info(f"Consolidation level {level}: merging {len(analyses)} analyses in {len(groups)} groups")
+        with ThreadPoolExecutor(max_workers=max(1, min(max_parallel, len(groups))), thread_name_prefix="ollama-merge") as executor:
+            analyses = list(executor.map(merge, groups))
+    return analyses
+
+# Notes _analyze_chunk leaves in place of an analysis; they are not merged, cached or reused
+INCOMPLETE_ANALYSIS_PREFIXES = ("## Error", "## Analysis Timeout", "## Analysis Cancelled")
+
+def is_incomplete_analysis(text):
+    """Whether a chunk analysis is an error, timeout or cancellation note rather than a real analysis"""
+    return text.startswith(INCOMPLETE_ANALYSIS_PREFIXES)
+
+def _analyze_chunk(invoke, i, total, invoke_params, timeout, deadline=None, cancel=None):
+    """Run one chunk through invoke(params, deadline, cancel); returns (analysis text, visualization data)
+
+    invoke applies the per-call timeout itself, from when the call gets an LLM slot.
+    """
+    if cancel is not None and cancel.is_set():
+        logger.info(f"Skipping chunk {i}: analysis cancelled")
+        return f"## Analysis Cancelled for Content Chunk {i}\n\nThis section was skipped because the analysis was cancelled.", None
+    if deadline is not None and deadline.expired():
+        logger.warning(f"Skipping chunk {i}: report time budget exhausted")
+        return f"## Analysis Timeout for Content Chunk {i}\n\nThis section was skipped because the report's time budget ran out.", None
+    
+    logger.info(f"Analyzing chunk {i} of {total}")
+    
+    try:
+        response = invoke(invoke_params, deadline, cancel)
+        return clean_analysis_text(response), extract_visualization_data(response)
+    
+    except TimeoutException as e:
+        logger.error(f"Analysis of chunk {i} timed out: {str(e)}")
+        return f"## Analysis Timeout for Content Chunk {i}\n\nThe analysis took too long to complete ({str(e)}).", None
+    
+    except CancelledError:
+        # Not a model failure: the caller stopped the analysis
+        logger.info(f"Analysis of chunk {i} was cancelled")
+        return f"## Analysis Cancelled for Content Chunk {i}\n\nThe analysis was cancelled before this section was done.", None
+    
+    except Exception as e:
+        logger.error(f"Error analyzing chunk {i}: {str(e)}")
+        return f"## Error Analyzing Content Chunk {i}\n\nThere was an error processing this section: {str(e)}", None
+
+def stream_trends_with_ollama(dom_chunks, industry, analysis_type, time_period, detail_level, model="llama3:latest", timeout=180, custom_prompt="", num_ctx=None, max_parallel=None, prior_analyses=None, consolidation_fan_in=None, budget=None, visualization_dir="visualizations", priority=PRIORITY_INTERACTIVE, cancel=None):
+    """Analyze industry trends from content chunks using Ollama LLM, yielding progress events
+
+    Events are dicts with a "type":
+    - "chunk": one chunk analysis finished ("index", "total", "text"), in completion order
+    - "status": a new stage started ("message")
+    - "token": the next piece of the consolidated report as the model generates it ("text")
+    - "result": the final result dict, always the last event ("result")
+    Closing the generator early aborts in-flight chunk requests and drops queued ones.
+    Setting cancel (a threading.Event) from another thread also stops queued and running
+    calls, including the consolidation, which closing cannot interrupt.
+
+    timeout caps each LLM call (twice that for the final consolidation); budget, in seconds,
+    caps the whole report. Chunk analysis may use CHUNK_BUDGET_SHARE of the budget, and calls
+    still running when their deadline passes are aborted on the server, not just abandoned.
+
+    prior_analyses are chunk analyses from earlier runs (incremental mode); they are merged
+    with the new chunk analyses in the consolidation step. The result's "chunk_analyses"
+    holds this run's per-chunk analyses so callers can store them. When there are more than
+    consolidation_fan_in analyses they are first merged in groups, over as many levels as needed.
+
+    Every LLM call goes through the process-wide scheduler as one job at the given priority,
+    so concurrent reports share the server fairly and batch runs yield to interactive ones.
+    """
+    template = select_template(industry)
     prompt = ChatPromptTemplate.from_template(template)
     
     try:
-        # Check if Ollama server is running
+        # Check if Ollama server is running (uses the registry's cached tag list)
         try:
-            response = requests.get("http://localhost:11434/api/tags", timeout=5)
-            if response.status_code != 200:
-                raise Exception(f"Ollama API returned status code {response.status_code}")
-        except requests.exceptions.RequestException as e:
+            _model_registry.available_models()
+        except httpx.HTTPError as e:
             error_msg = f"""
 # Error Connecting to Ollama Server
 
@@ -595,10 +939,10 @@ The application couldn't connect to the Ollama server. Error: {str(e)}
 ## Possible solutions:
 1. Ensure Ollama is installed - visit https://ollama.ai/download
 2. Start the Ollama service with `ollama serve` in a terminal
-3. Verify no firewall is blocking port 11434
+3. Verify no firewall is blocking the configured server(s): {", ".join(configured_hosts())}
 
 ## Troubleshooting Steps:
-1. Open a terminal and run: `curl http://localhost:11434/api/tags`
+1. Open a terminal and run: `curl {configured_hosts()[0]}/api/tags`
 2. If it returns a list of models, Ollama is running but may not have the required models
 3. Run: `ollama pull llama3` to download a model
 
@@ -609,10 +953,10 @@ Here's a placeholder analysis based on the parameters you provided. Please retry
 - Unable to analyze data due to Ollama server connection error
 - Check the extracted content for insights manually
 """
-            return {"text": error_msg, "visualizations": []}
+            yield {"type": "result", "result": {"text": error_msg, "visualizations": []}}
+            return
             
-        model_obj = create_ollama_model(model_name=model)
-        chain = prompt | model_obj
+        model_obj = create_ollama_model(model_name=model, num_ctx=num_ctx)
     except Exception as e:
         error_msg = f"""
 # Error Initializing AI Model
@@ -624,74 +968,61 @@ Unfortunately, there was an error initializing the local Ollama model: {str(e)}
 2. Check if you have the required models installed with `ollama list`
 3. Install needed models with `ollama pull llama3` or `ollama pull mistral`
 """
-        return {"text": error_msg, "visualizations": []}
+        yield {"type": "result", "result": {"text": error_msg, "visualizations": []}}
+        return
     
-    analysis_results = []
-    visualization_data_list = []
+    budget = DEFAULT_REPORT_BUDGET if budget is None else budget
+    report_deadline = Deadline(budget or None)
+    chunk_deadline = Deadline(budget * CHUNK_BUDGET_SHARE) if budget else report_deadline
+    cancel = cancel or threading.Event()
+    # Set once chunk analysis is over, so leftover chunk calls stop without cancelling the report
+    chunks_done = threading.Event()
+    chunk_cancel = _AnyEvent(cancel, chunks_done)
     
-    for i, chunk in enumerate(dom_chunks, start=1):
-        logger.info(f"Analyzing chunk {i} of {len(dom_chunks)}")
-        
-        try:
-            result_container = [None]
-            exception_container = [None]
-            
-            def analyze_with_timeout():
-                try:
-                    # Create the correct input parameters based on template
-                    if industry == "Healthcare" or industry == "Finance":
-                        invoke_params = {
-                            "dom_content": chunk, 
-                            "analysis_type": analysis_type,
-                            "time_period": time_period,
-                            "detail_level": detail_level,
-                            "custom_prompt": custom_prompt
-                        }
-                    else:
-                        invoke_params = {
-                            "dom_content": chunk, 
-                            "industry": industry,
-                            "analysis_type": analysis_type,
-                            "time_period": time_period,
-                            "detail_level": detail_level,
-                            "custom_prompt": custom_prompt
-                        }
-                    
-                    result_container[0] = chain.invoke(invoke_params)
-                except Exception as e:
-                    exception_container[0] = e
-            
-            analysis_thread = threading.Thread(target=analyze_with_timeout)
-            analysis_thread.daemon = True
-            analysis_thread.start()
-            analysis_thread.join(timeout)
-            
-            if analysis_thread.is_alive():
-                logger.error(f"Analysis of chunk {i} timed out after {timeout} seconds")
-                error_response = f"## Analysis Timeout for Content Chunk {i}\n\nThe analysis took too long to complete (timeout after {timeout} seconds)."
-                analysis_results.append(error_response)
-                continue
-            
-            if exception_container[0] is not None:
-                raise exception_container[0]
-            
-            response = result_container[0]
-            viz_data = extract_visualization_data(response)
-            if viz_data:
-                visualization_data_list.append(viz_data)
-            
-            cleaned_response = clean_analysis_text(response)
-            analysis_results.append(cleaned_response)
-                
-        except Exception as e:
-            logger.error(f"Error analyzing chunk {i}: {str(e)}")
-            error_response = f"## Error Analyzing Content Chunk {i}\n\nThere was an error processing this section: {str(e)}"
-            analysis_results.append(error_response)
+    max_parallel = max(1, min(max_parallel or DEFAULT_MAX_PARALLEL, len(dom_chunks) or 1))
+    logger.info(f"Analyzing {len(dom_chunks)} chunks with up to {max_parallel} concurrent requests")
+    
+    model_name = getattr(model_obj, "model", model)
+    llm_job = get_llm_scheduler().job(f"{industry} {analysis_type}", priority=priority)
     
-    combined_analysis = "\n\n".join(analysis_results)
+    def invoke_chunk(invoke_params, deadline, cancel):
+        return _cached_invoke(prompt, model_name, template, invoke_params, num_ctx, deadline, cancel, llm_job, timeout)
     
-    # For multiple chunks, add consolidation
-    if len(dom_chunks) > 1 and any([not (isinstance(result, str) and result.startswith('## Error')) for result in analysis_results]):
+    def analyze_chunk(indexed_chunk):
+        i, chunk = indexed_chunk
+        invoke_params = build_invoke_params(chunk, industry, analysis_type, time_period, detail_level, custom_prompt)
+        return _analyze_chunk(invoke_chunk, i, len(dom_chunks), invoke_params, timeout, chunk_deadline, chunk_cancel)
+    
+    # Report chunks as they finish, but keep results in chunk order
+    chunk_results = [None] * len(dom_chunks)
+    executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="ollama-chunk")
+    try:
+        futures = {executor.submit(analyze_chunk, (i, chunk)): i for i, chunk in enumerate(dom_chunks, start=1)}
+        for future in as_completed(futures):
+            i = futures[future]
+            chunk_results[i - 1] = future.result()
+            yield {"type": "chunk", "index": i, "total": len(dom_chunks), "text": chunk_results[i - 1][0]}
+    finally:
+        # Runs on normal completion and when the consumer closes the generator: abort running chunks, drop unstarted ones
+        chunks_done.set()
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    analysis_results = [text for text, _ in chunk_results]
+    logger.info(f"Chunk calls waited {llm_job.wait_seconds:.1f}s in total for LLM slots over {llm_job.calls} calls")
+    visualization_data_list = [viz_data for _, viz_data in chunk_results if viz_data]
+    
+    # A failed call may mean the model was removed or the server restarted; re-validate next time
+    if any(text.startswith("## Error") for text in analysis_results):
+        # Calls run on the resolved name (a fallback model, maybe); drop those entries too
+        _model_registry.invalidate(model_name)
+        if model_name != model:
+            _model_registry.invalidate(model)
+    
+    prior_analyses = prior_analyses or []
+    combined_analysis = "\n\n".join(prior_analyses + analysis_results)
+    
+    # For multiple chunks (or new chunks plus earlier analyses), add consolidation
+    if len(prior_analyses) + len(dom_chunks) > 1 and any([not (isinstance(result, str) and result.startswith('## Error')) for result in prior_analyses + analysis_results]):
         consolidation_prompt_template = """
         You are a senior industry analyst specializing in {industry} markets.
         
@@ -752,49 +1083,59 @@ Unfortunately, there was an error initializing the local Ollama model: {str(e)}
         
         try:
             consolidation_prompt = ChatPromptTemplate.from_template(consolidation_prompt_template)
-            consolidation_chain = consolidation_prompt | model_obj
-            
-            result_container = [None]
-            exception_container = [None]
             
-            def consolidate_with_timeout():
-                try:
-                    result_container[0] = consolidation_chain.invoke({
-                        "combined_analysis": combined_analysis,
-                        "industry": industry,
-                        "detail_level": detail_level
-                    })
-                except Exception as e:
-                    exception_container[0] = e
+            # Merge many or large analyses in bounded groups first so the final prompt stays within the context window;
+            # error, timeout and cancellation notes are left out of the prompt either way
+            fan_in = consolidation_fan_in or DEFAULT_CONSOLIDATION_FAN_IN
+            mergeable = [r for r in prior_analyses + analysis_results if not is_incomplete_analysis(r)]
+            consolidation_input = "\n\n".join(mergeable) if mergeable else combined_analysis
+            final_budget = (num_ctx or get_context_window(model_name)) - OUTPUT_TOKEN_RESERVE - count_tokens(consolidation_prompt_template)
+            over_budget = final_budget > 0 and count_tokens(consolidation_input) > final_budget
+            if fan_in > 1 and (len(mergeable) > fan_in or over_budget):
+                yield {"type": "status", "message": f"Merging {len(mergeable)} analyses in groups of {fan_in}"}
+                merged = _tree_merge(mergeable, model_name, industry, fan_in, max_parallel, timeout, num_ctx, report_deadline, llm_job,
+                                     max_tokens=final_budget if final_budget > 0 else None, cancel=cancel)
+                consolidation_input = "\n\n".join(merged)
             
-            consolidation_thread = threading.Thread(target=consolidate_with_timeout)
-            consolidation_thread.daemon = True
-            consolidation_thread.start()
-            consolidation_thread.join(timeout * 2)
-            
-            if consolidation_thread.is_alive():
-                logger.error(f"Consolidation timed out after {timeout*2} seconds")
-                return {"text": f"# {industry} Industry Analysis\n\n*Note: Final consolidation could not be completed due to timeout.*\n\n{combined_analysis}", 
-                        "visualizations": []}
-            
-            if exception_container[0] is not None:
-                raise exception_container[0]
+            yield {"type": "status", "message": "Consolidating the final report"}
+            pieces = []
+            try:
+                for piece in _cached_stream(consolidation_prompt, model_name, consolidation_prompt_template, {
+                    "combined_analysis": consolidation_input,
+                    "industry": industry,
+                    "detail_level": detail_level
+                }, num_ctx, report_deadline, cancel, llm_job, timeout * 2):
+                    pieces.append(piece)
+                    yield {"type": "token", "text": piece}
+            except TimeoutException as e:
+                logger.error(f"Consolidation stopped: {str(e)}")
+                yield {"type": "result", "result": {"text": f"# {industry} Industry Analysis\n\n*Note: Final consolidation could not be completed due to timeout.*\n\n{combined_analysis}", 
+                        "visualizations": [], "chunk_analyses": analysis_results}}
+                return
             
-            final_analysis = result_container[0]
+            final_analysis = "".join(pieces)
             consolidated_viz_data = extract_visualization_data(final_analysis)
             
             visualization_paths = []
             if consolidated_viz_data:
-                visualization_paths = generate_visualizations(consolidated_viz_data, industry)
+                visualization_paths = generate_visualizations(consolidated_viz_data, industry, visualization_dir)
             
             final_text = clean_analysis_text(final_analysis)
             
-            return {"text": final_text, "visualizations": visualization_paths}
+            yield {"type": "result", "result": {"text": final_text, "visualizations": visualization_paths, "chunk_analyses": analysis_results}}
+            return
+        
+        except CancelledError:
+            logger.info("Consolidation was cancelled")
+            yield {"type": "result", "result": {"text": f"# {industry} Industry Analysis\n\n*Note: The analysis was cancelled before the final consolidation.*\n\n{combined_analysis}", 
+                    "visualizations": [], "chunk_analyses": analysis_results}}
+            return
         
         except Exception as e:
             logger.error(f"Error during consolidation: {str(e)}")
-            return {"text": f"# {industry} Industry Analysis\n\n*Error during consolidation: {str(e)}*\n\n{combined_analysis}", 
-                    "visualizations": []}
+            yield {"type": "result", "result": {"text": f"# {industry} Industry Analysis\n\n*Error during consolidation: {str(e)}*\n\n{combined_analysis}", 
+                    "visualizations": [], "chunk_analyses": analysis_results}}
+            return
     
     # If no consolidation needed, generate visualizations from individual analyses
     visualization_paths = []
@@ -802,9 +1143,19 @@ Unfortunately, there was an error initializing the local Ollama model: {str(e)}
         # Handle the first visualization data for simplicity
         # This avoids merging issues and ensures at least one set of visualizations
         if visualization_data_list[0]:
-            visualization_paths = generate_visualizations(visualization_data_list[0], industry)
+            visualization_paths = generate_visualizations(visualization_data_list[0], industry, visualization_dir)
     
-    return {"text": combined_analysis, "visualizations": visualization_paths}
+    yield {"type": "result", "result": {"text": combined_analysis, "visualizations": visualization_paths, "chunk_analyses": analysis_results}}
+
+def analyze_trends_with_ollama(dom_chunks, industry, analysis_type, time_period, detail_level, model="llama3:latest", timeout=180, custom_prompt="", num_ctx=None, max_parallel=None, prior_analyses=None, consolidation_fan_in=None, budget=None, visualization_dir="visualizations", priority=PRIORITY_INTERACTIVE, cancel=None):
+    """Analyze industry trends from content chunks using Ollama LLM and return the final result dict"""
+    result = None
+    for event in stream_trends_with_ollama(dom_chunks, industry, analysis_type, time_period, detail_level, model,
+                                           timeout, custom_prompt, num_ctx, max_parallel, prior_analyses,
+                                           consolidation_fan_in, budget, visualization_dir, priority, cancel):
+        if event["type"] == "result":
+            result = event["result"]
+    return result
 
 def generate_report_with_visuals(analysis_text, visualization_paths, industry, date=None, output_format="html"):
     """Generate a complete report with embedded visualizations"""
@@ -1018,12 +1369,12 @@ def generate_report_with_visuals(analysis_text, visualization_paths, industry, d
     else:
         raise ValueError("Unsupported output format: {}".format(output_format))
 
-def save_report(report_content, industry, output_format="html", output_dir="reports"):
-    """Save the generated report to a file"""
+def save_report(report_content, industry, output_format="html", output_dir="reports", name=None):
+    """Save the generated report to a file; name replaces the default "<industry>_analysis" prefix"""
     os.makedirs(output_dir, exist_ok=True)
     
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{industry.lower()}_analysis_{timestamp}.{output_format}"
+    filename = f"{name or industry.lower() + '_analysis'}_{timestamp}.{output_format}"
     file_path = os.path.join(output_dir, filename)
     
     with open(file_path, "w", encoding="utf-8") as f:
@@ -1034,19 +1385,15 @@ def save_report(report_content, industry, output_format="html", output_dir="repo
 
 def analyze_content(content, industry="Technology", analysis_type="Comprehensive", 
                    time_period="Current and Near-Future", detail_level="Detailed", 
-                   model="llama3:latest", custom_prompt="", timeout=180):
+                   model="llama3:latest", custom_prompt="", timeout=180, max_parallel=None,
+                   consolidation_fan_in=None, budget=None):
     """Main function to analyze content and generate a report"""
+    from scrape import split_dom_content
     
-    # Split content into chunks if needed
-    max_chunk_length = 4000  # Characters per chunk
-    content_chunks = []
-    
-    if len(content) > max_chunk_length:
-        # Simple chunking by character length
-        chunks = [content[i:i+max_chunk_length] for i in range(0, len(content), max_chunk_length)]
-        content_chunks = chunks
-    else:
-        content_chunks = [content]
+    # Pack content into chunks that fill the model's context window after the template
+    num_ctx = get_context_window(model)
+    max_tokens = get_chunk_token_budget(model, industry, analysis_type, time_period, detail_level, custom_prompt, num_ctx=num_ctx)
+    content_chunks = split_dom_content(content, max_tokens=max_tokens)
     
     # Log analysis parameters
     logger.info(f"Analyzing {industry} industry content ({len(content_chunks)} chunks)")
@@ -1061,7 +1408,11 @@ def analyze_content(content, industry="Technology", analysis_type="Comprehensive
         detail_level,
         model=model,
         timeout=timeout,
-        custom_prompt=custom_prompt
+        custom_prompt=custom_prompt,
+        num_ctx=num_ctx,
+        max_parallel=max_parallel,
+        consolidation_fan_in=consolidation_fan_in,
+        budget=budget
     )
     
     # Generate report with visualizations
@@ -1106,6 +1457,12 @@ def main():
                        help="Custom prompt to guide the analysis")
     parser.add_argument("--timeout", type=int, default=180,
                        help="Timeout for each analysis chunk in seconds")
+    parser.add_argument("--budget", type=float, default=DEFAULT_REPORT_BUDGET,
+                       help="End-to-end time budget for the report in seconds (0 for none)")
+    parser.add_argument("--max-parallel", type=int, default=DEFAULT_MAX_PARALLEL,
+                       help="Chunks analysed concurrently; match the server's OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--consolidation-fan-in", type=int, default=DEFAULT_CONSOLIDATION_FAN_IN,
+                       help="Analyses merged per consolidation call; larger reports are consolidated as a tree")
     parser.add_argument("--output-format", type=str, default="html",
                        choices=["html", "markdown"],
                        help="Output format for the report")
@@ -1143,7 +1500,10 @@ def main():
             detail_level=args.detail_level,
             model=args.model,
             custom_prompt=args.custom_prompt,
-            timeout=args.timeout
+            timeout=args.timeout,
+            max_parallel=args.max_parallel,
+            consolidation_fan_in=args.consolidation_fan_in,
+            budget=args.budget
         )
         
         print(f"\nAnalysis complete! Report saved to: {result['report_path']}")
@@ -0,0 +1,274 @@
+"""Headless batch report runner
+
+Usage:
+    python batch.py MANIFEST.json [--output-dir reports] [--jobs 4] [--max-llm-requests 2]
+
+The manifest lists report jobs; list values are expanded into every combination:
+
+    {
+      "defaults": {"model": "llama3:latest", "detail_level": "Detailed", "output_format": "html"},
+      "jobs": [
+        {"industry": "Healthcare", "analysis_type": ["Comprehensive", "Market Trends"],
+         "time_period": "Current and Near-Future"},
+        {"industry": "Technology", "analysis_type": "Competitive Analysis",
+         "sources": ["https://techcrunch.com/", "https://www.technologyreview.com/"]}
+      ]
+    }
+
+Every source is scraped once for the whole batch, and LLM calls from all jobs share one
+concurrency limit, so a nightly run costs one scraping pass however many reports it writes.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from scrape import process_sources, get_industry_sources, name_sources, label_chunks
+from dedup import dedup_chunks
+from relevance import filter_relevant
+from analyze import (
+    analyze_trends_with_ollama,
+    generate_report_with_visuals,
+    save_report,
+    get_chunk_token_budget,
+    get_context_window,
+    set_llm_concurrency,
+    is_incomplete_analysis,
+    DEFAULT_MAX_PARALLEL,
+    DEFAULT_REPORT_BUDGET
+)
+from scheduler import get_llm_scheduler, PRIORITY_BATCH
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_DEFAULTS = {
+    "analysis_type": "Comprehensive",
+    "time_period": "Current and Near-Future",
+    "detail_level": "Detailed",
+    "model": "llama3:latest",
+    "custom_prompt": "",
+    "timeout": 180,
+    "budget": DEFAULT_REPORT_BUDGET,
+    "output_format": "html"
+}
+
+# Keys whose list values are expanded into one job per combination
+MATRIX_KEYS = ["industry", "analysis_type", "time_period", "detail_level", "model"]
+
+def _slug(text):
+    return re.sub(r"[^a-z0-9]+", "_", text.lower()).strip("_")
+
+def expand_manifest(manifest):
+    """Expand a manifest into a list of concrete job dicts, each with a list of source URLs"""
+    defaults = dict(JOB_DEFAULTS, **manifest.get("defaults", {}))
+    jobs = []
+    for entry in manifest.get("jobs", []):
+        entry = dict(defaults, **entry)
+        if "industry" not in entry:
+            raise ValueError(f"Job is missing an industry: {entry}")
+
+        axes = [entry[key] if isinstance(entry[key], list) else [entry[key]] for key in MATRIX_KEYS]
+        for values in itertools.product(*axes):
+            job = dict(entry, **dict(zip(MATRIX_KEYS, values)))
+            sources = job.get("sources")
+            industry_sources = get_industry_sources()
+            if sources is None:
+                # Jobs without their own sources use the industry's sources from the app
+                if job["industry"] not in industry_sources:
+                    raise ValueError(f"No default sources for {job['industry']}; list them under \"sources\"")
+                sources = industry_sources[job["industry"]]["sources"]
+            # Sources may be a list of URLs or a {name: url} mapping; listed URLs are named like the app names them
+            if isinstance(sources, dict):
+                job["sources"], job["source_names"] = list(sources.values()), list(sources)
+            else:
+                job["sources"] = list(sources)
+                job["source_names"] = name_sources(job["sources"], industry_sources.get(job["industry"], {}).get("sources", {}))
+            job["name"] = _slug(" ".join(str(job[key]) for key in MATRIX_KEYS))
+            jobs.append(job)
+
+    # Jobs with the same name would overwrite each other's reports
+    names = [job["name"] for job in jobs]
+    for name in set(names):
+        duplicates = [job for job in jobs if job["name"] == name]
+        if len(duplicates) > 1:
+            for i, job in enumerate(duplicates, start=1):
+                job["name"] = f"{name}_{i}"
+    return jobs
+
+def scrape_all(jobs, chunk_size=8000, max_workers=4, token_chunking=True):
+    """Scrape every distinct source once; returns ({url: chunks} for the sources that succeeded, chunk token budget)
+
+    With token chunking, chunks are sized for the job with the smallest token budget so
+    the same chunks fit every job.
+    """
+    urls = list(dict.fromkeys(url for job in jobs for url in job["sources"]))
+
+    max_tokens = None
+    if token_chunking:
+        max_tokens = min(
+            get_chunk_token_budget(job["model"], job["industry"], job["analysis_type"], job["time_period"],
+                                   job["detail_level"], job["custom_prompt"], num_ctx=get_context_window(job["model"]))
+            for job in jobs
+        )
+
+    logger.info(f"Scraping {len(urls)} distinct sources for {len(jobs)} jobs")
+    chunks_by_url = {}
+    for i, url, chunks, error in process_sources(urls, chunk_size=chunk_size, max_workers=max_workers, max_tokens=max_tokens):
+        if error is not None:
+            logger.error(f"Error processing {url}: {str(error)}")
+        else:
+            chunks_by_url[url] = chunks
+    return chunks_by_url, max_tokens
+
+def run_job(job, chunks_by_url, output_dir, max_parallel, dedup=True, relevance_budget=None, max_tokens=None):
+    """Analyze one job's chunks and write its report; returns a summary dict"""
+    start = time.time()
+    # The same {"source", "url", "content"} chunks the app analyses, so both share LLM cache entries
+    chunks = label_chunks(job["sources"], job["source_names"], chunks_by_url)
+    tokens_saved = 0
+    if dedup and chunks:
+        chunks, dedup_stats = dedup_chunks(chunks)
+        tokens_saved = dedup_stats["tokens_saved"]
+    if relevance_budget is not None and chunks:
+        chunks, relevance_stats = filter_relevant(chunks, job["industry"], max_tokens=relevance_budget or None, pack_tokens=max_tokens)
+        tokens_saved += relevance_stats["tokens_saved"]
+    if not chunks:
+        return {"name": job["name"], "status": "failed", "error": "No content scraped from the job's sources"}
+
+    result = analyze_trends_with_ollama(
+        chunks,
+        industry=job["industry"],
+        analysis_type=job["analysis_type"],
+        time_period=job["time_period"],
+        detail_level=job["detail_level"],
+        model=job["model"],
+        timeout=job["timeout"],
+        custom_prompt=job["custom_prompt"],
+        num_ctx=get_context_window(job["model"]),
+        max_parallel=max_parallel,
+        budget=job["budget"],
+        visualization_dir=os.path.join(output_dir, "visualizations", job["name"]),
+        priority=PRIORITY_BATCH
+    )
+
+    report_content = generate_report_with_visuals(
+        result["text"],
+        result["visualizations"],
+        job["industry"],
+        output_format=job["output_format"]
+    )
+    report_path = save_report(report_content, job["industry"], job["output_format"], output_dir, name=job["name"])
+
+    failed_chunks = [a for a in result.get("chunk_analyses", []) if is_incomplete_analysis(a)]
+    return {
+        "name": job["name"],
+        "status": "partial" if failed_chunks else "ok",
+        "report_path": report_path,
+        "chunks": len(chunks),
+        "failed_chunks": len(failed_chunks),
+        "tokens_saved": tokens_saved,
+        "seconds": round(time.time() - start, 1)
+    }
+
+def run_batch(manifest, output_dir="reports", jobs_in_parallel=4, max_llm_requests=DEFAULT_MAX_PARALLEL,
+              max_parallel=None, scrape_workers=4, chunk_size=8000, token_chunking=True, dedup=True,
+              relevance_budget=0):
+    """Run every job in the manifest and write a batch_summary JSON next to the reports
+
+    relevance_budget caps the tokens of industry-relevant text per job (0 keeps every
+    relevant paragraph, None turns the relevance filter off).
+    """
+    jobs = expand_manifest(manifest)
+    if not jobs:
+        logger.warning("Manifest contains no jobs")
+        return []
+
+    chunks_by_url, max_tokens = scrape_all(jobs, chunk_size=chunk_size, max_workers=scrape_workers, token_chunking=token_chunking)
+
+    # Jobs run side by side; the global limit keeps their combined LLM calls within what the server can serve,
+    # and at batch priority they only take slots interactive reports in the same process leave free
+    previous_limit = set_llm_concurrency(max_llm_requests)
+    summaries = []
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, jobs_in_parallel), thread_name_prefix="batch-job") as executor:
+            futures = {executor.submit(run_job, job, chunks_by_url, output_dir, max_parallel or max_llm_requests,
+                                   dedup, relevance_budget, max_tokens): job for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    summary = future.result()
+                except Exception as e:
+                    logger.error(f"Job {job['name']} failed: {str(e)}")
+                    summary = {"name": job["name"], "status": "failed", "error": str(e)}
+                logger.info(f"Job {summary['name']}: {summary['status']}")
+                summaries.append(summary)
+    finally:
+        set_llm_concurrency(previous_limit)
+    
+    queue_stats = get_llm_scheduler().stats()
+    logger.info(f"LLM calls waited {queue_stats['wait_seconds']['mean']:.1f}s on average "
+                f"(p95 {queue_stats['wait_seconds']['p95']:.1f}s) for a free slot")
+
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    summary_path = os.path.join(output_dir, f"batch_summary_{timestamp}.json")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump(sorted(summaries, key=lambda s: s["name"]), f, indent=2)
+    logger.info(f"Batch summary saved to {summary_path}")
+    return summaries
+
+def main():
+    parser = argparse.ArgumentParser(description="Run many industry reports from a job manifest")
+    parser.add_argument("manifest", help="Path to a JSON job manifest")
+    parser.add_argument("--output-dir", default="reports", help="Directory for reports, charts and the batch summary")
+    parser.add_argument("--jobs", type=int, default=4, help="Reports analysed at the same time")
+    parser.add_argument("--max-llm-requests", type=int, default=DEFAULT_MAX_PARALLEL,
+                        help="LLM calls in flight across all jobs; match the server's OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--max-parallel", type=int, default=None,
+                        help="LLM calls in flight per job (defaults to --max-llm-requests)")
+    parser.add_argument("--scrape-workers", type=int, default=4, help="Sources scraped concurrently")
+    parser.add_argument("--chunk-size", type=int, default=8000, help="Maximum chunk length in characters")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Keep near-duplicate paragraphs instead of removing them before analysis")
+    parser.add_argument("--relevance-budget", type=int, default=0,
+                        help="Most tokens of industry-relevant text analysed per job (0 for no cap)")
+    parser.add_argument("--no-relevance-filter", action="store_true",
+                        help="Analyse all scraped text instead of only industry-relevant paragraphs")
+    parser.add_argument("--no-token-chunking", action="store_true",
+                        help="Chunk by characters only instead of sizing chunks to the model's context window")
+
+    args = parser.parse_args()
+    try:
+        with open(args.manifest, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        summaries = run_batch(
+            manifest,
+            output_dir=args.output_dir,
+            jobs_in_parallel=args.jobs,
+            max_llm_requests=args.max_llm_requests,
+            max_parallel=args.max_parallel,
+            scrape_workers=args.scrape_workers,
+            chunk_size=args.chunk_size,
+            token_chunking=not args.no_token_chunking,
+            dedup=not args.no_dedup,
+            relevance_budget=None if args.no_relevance_filter else args.relevance_budget
+        )
+    except (OSError, ValueError) as e:
+        print(f"Error: {str(e)}")
+        sys.exit(1)
+
+    for summary in sorted(summaries, key=lambda s: s["name"]):
+        print(f"{summary['status']:>8}  {summary['name']}  {summary.get('report_path', summary.get('error', ''))}")
+    if any(summary["status"] == "failed" for summary in summaries):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Micro-benchmarks for the scraping pipeline
+
+Usage:
+    python benchmark.py extract PAGES_DIR
+    python benchmark.py chunk [--sizes-mb 1 4 8]
+
+The equivalence check of the chunker against its legacy implementation lives in
+test_chunker.py and runs with pytest.
+"""
+import argparse
+import glob
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+from bs4 import BeautifulSoup
+
+from scrape import extract_body_content, clean_body_content, split_dom_content
+from test_chunker import legacy_split_dom_content
+
+def legacy_extract_body_content(html_content):
+    """extract_body_content as it was before the single-parse engine"""
+    soup = BeautifulSoup(html_content, "html.parser")
+    content_elements = [
+        soup.find_all('article'),
+        soup.find_all('div', {'class': ['post', 'article', 'entry', 'content', 'news-item']}),
+        soup.find_all('div', {'id': ['content', 'main-content', 'article-content', 'post-content']}),
+        soup.find_all('main'),
+        soup.find_all('section', {'class': ['content', 'main', 'articles', 'news']}),
+        soup.find_all('h2'),
+        soup.find_all('h3')
+    ]
+
+    for elements in content_elements:
+        if elements:
+            content = "\n\n".join([element.get_text(separator="\n") for element in elements])
+            if content and len(content) > 500:
+                return content
+
+    body_content = soup.body
+    if body_content:
+        return body_content.get_text(separator="\n")
+    return "No content found on the page."
+
+def legacy_clean_body_content(body_content):
+    """clean_body_content as it was before the single-parse engine"""
+    soup = BeautifulSoup(f"<div>{body_content}</div>", "html.parser")
+    for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'meta', 'form', 'iframe', 'noscript']):
+        element.extract()
+
+    content = soup.get_text(separator="\n")
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    cleaned_content = "\n".join(lines)
+    cleaned_content = re.sub(r'\n{3,}', '\n\n', cleaned_content)
+    cleaned_content = re.sub(r'(subscribe to our newsletter|sign up for our newsletter|subscribe for updates|email address).*', '', cleaned_content, flags=re.IGNORECASE)
+    return cleaned_content
+
+def benchmark_chunk(sizes_mb=(1, 4, 8), max_length=8000, seed=0):
+    """Time and trace memory for legacy and current chunking of multi-MB documents"""
+    rng = random.Random(seed)
+    words = ["market", "growth", "startup", "funding", "regulation", "payments", "AI", "health"]
+    print(f"{'size MB':>8} {'shape':>10} {'legacy ms':>10} {'new ms':>8} {'legacy peak MB':>15} {'new peak MB':>12}")
+    for size_mb in sizes_mb:
+        target = int(size_mb * 2**20)
+        sentences = []
+        size = 0
+        while size < target:
+            sentence = " ".join(rng.choice(words) for _ in range(rng.randint(5, 25)))
+            sentences.append(sentence)
+            size += len(sentence) + 2
+        # One document made of short paragraphs and one made of a single run-on paragraph
+        documents = {
+            "paragraphs": "\n\n".join(". ".join(sentences[i:i + 4]) for i in range(0, len(sentences), 4)),
+            "run-on": ". ".join(sentences)
+        }
+        for shape, document in documents.items():
+            legacy_time, legacy_peak = _measure(legacy_split_dom_content, document, max_length, repeat=1)
+            current_time, current_peak = _measure(split_dom_content, document, max_length, repeat=1)
+            print(f"{size_mb:>8} {shape:>10} {legacy_time * 1000:>10.1f} {current_time * 1000:>8.1f} "
+                  f"{legacy_peak / 2**20:>15.1f} {current_peak / 2**20:>12.1f}")
+
+def _measure(func, *args, repeat=3):
+    """Return (best wall time in seconds, peak traced memory in bytes) for func(*args)"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def benchmark_extract(pages_dir, repeat=3):
+    """Compare legacy and current extract+clean on every saved .html page in pages_dir"""
+    paths = sorted(glob.glob(os.path.join(pages_dir, "*.html")))
+    if not paths:
+        print(f"No .html pages found in {pages_dir}")
+        return []
+
+    def legacy(html):
+        return legacy_clean_body_content(legacy_extract_body_content(html))
+
+    def current(html):
+        return clean_body_content(extract_body_content(html))
+
+    rows = []
+    print(f"{'page':<48} {'size KB':>8} {'legacy ms':>10} {'new ms':>8} {'legacy peak MB':>15} {'new peak MB':>12}")
+    for path in paths:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        legacy_time, legacy_peak = _measure(legacy, html, repeat=repeat)
+        current_time, current_peak = _measure(current, html, repeat=repeat)
+        rows.append((path, legacy_time, current_time, legacy_peak, current_peak))
+        print(f"{os.path.basename(path)[:48]:<48} {len(html) / 1024:>8.0f} {legacy_time * 1000:>10.1f} "
+              f"{current_time * 1000:>8.1f} {legacy_peak / 2**20:>15.1f} {current_peak / 2**20:>12.1f}")
+
+    legacy_total = sum(row[1] for row in rows)
+    current_total = sum(row[2] for row in rows)
+    print(f"\nTotal: legacy {legacy_total * 1000:.0f} ms, new {current_total * 1000:.0f} ms "
+          f"({legacy_total / max(current_total, 1e-9):.1f}x)")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Scraping pipeline benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = subparsers.add_parser("extract", help="Benchmark HTML extraction and cleaning on saved pages")
+    extract_parser.add_argument("pages_dir", help="Directory of saved .html pages (e.g. a SCRAPER_FIXTURE_DIR)")
+    extract_parser.add_argument("--repeat", type=int, default=3, help="Timed runs per page; the best is reported")
+
+    chunk_parser = subparsers.add_parser("chunk", help="Benchmark split_dom_content")
+    chunk_parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 4, 8], help="Document sizes to benchmark")
+    chunk_parser.add_argument("--chunk-size", type=int, default=8000, help="Maximum chunk length in characters")
+
+    args = parser.parse_args()
+    if args.command == "extract":
+        benchmark_extract(args.pages_dir, repeat=args.repeat)
+    elif args.command == "chunk":
+        benchmark_chunk(sizes_mb=args.sizes_mb, max_length=args.chunk_size)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import re
+
+import numpy as np
+
+from tokens import count_tokens
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Mersenne prime used for the MinHash permutations; hashes are kept below it
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+def _shingle_hashes(text, k=5):
+    """32-bit hashes of the word k-shingles of text, ignoring case and punctuation"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < k:
+        shingles = [" ".join(words)] if words else []
+    else:
+        shingles = [" ".join(words[i:i + k]) for i in range(len(words) - k + 1)]
+    return np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in set(shingles)],
+        dtype=np.uint64
+    )
+
+class MinHashLSH:
+    """MinHash signatures with a banded LSH index for finding near-duplicate texts
+
+    With bands * rows = num_perm, texts whose Jaccard similarity is above roughly
+    (1 / bands) ** (1 / rows) share a band bucket with high probability; candidates are
+    then checked against threshold using the full signature.
+    """
+    def __init__(self, threshold=0.8, num_perm=64, bands=16, seed=1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        # a * h + b stays below 2**64 because a < 2**31 and h < 2**32
+        self._a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = []
+
+    def signature(self, text):
+        hashes = _shingle_hashes(text)
+        if hashes.size == 0:
+            return None
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % _PRIME
+        return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+    def query(self, signature):
+        """Return the index of an earlier text at least threshold-similar to signature, or None"""
+        candidates = set()
+        for band, buckets in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            candidates.update(buckets.get(key, ()))
+        for candidate in sorted(candidates):
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return candidate
+        return None
+
+    def add(self, signature):
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for band, buckets in enumerate(self._buckets):
+            key = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            buckets.setdefault(key, []).append(index)
+        return index
+
+def dedup_chunks(chunks, threshold=0.8, min_words=8):
+    """Drop paragraphs that nearly duplicate an earlier paragraph in any chunk; returns (chunks, stats)
+
+    Chunks may be strings or dicts with a "content" string (as built by main.py). Paragraphs
+    are lines; ones shorter than min_words are only dropped when repeated exactly, since
+    headlines and bylines are too short to compare by shingles. Chunks left empty are removed.
+    """
+    lsh = MinHashLSH(threshold=threshold)
+    seen_short = set()
+    kept_chunks = []
+    stats = {"chunks_in": len(chunks), "paragraphs_in": 0, "paragraphs_dropped": 0, "tokens_in": 0, "tokens_out": 0}
+
+    for chunk in chunks:
+        text = chunk["content"] if isinstance(chunk, dict) else chunk
+        stats["tokens_in"] += count_tokens(text)
+
+        kept_lines = []
+        for line in text.split("\n"):
+            if not line.strip():
+                kept_lines.append(line)
+                continue
+            stats["paragraphs_in"] += 1
+            if len(line.split()) < min_words:
+                key = " ".join(line.lower().split())
+                duplicate = key in seen_short
+                seen_short.add(key)
+            else:
+                signature = lsh.signature(line)
+                duplicate = signature is not None and lsh.query(signature) is not None
+                if signature is not None and not duplicate:
+                    lsh.add(signature)
+            if duplicate:
+                stats["paragraphs_dropped"] += 1
+            else:
+                kept_lines.append(line)
+
+        new_text = re.sub(r"\n{3,}", "\n\n", "\n".join(kept_lines)).strip()
+        if not new_text:
+            continue
+        stats["tokens_out"] += count_tokens(new_text)
+        kept_chunks.append(dict(chunk, content=new_text) if isinstance(chunk, dict) else new_text)
+
+    stats["chunks_out"] = len(kept_chunks)
+    stats["tokens_saved"] = stats["tokens_in"] - stats["tokens_out"]
+    logger.info(f"Dedup dropped {stats['paragraphs_dropped']} of {stats['paragraphs_in']} paragraphs and "
+                f"{stats['chunks_in'] - stats['chunks_out']} chunks, saving {stats['tokens_saved']} tokens")
+    return kept_chunks, stats
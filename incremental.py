@@ -0,0 +1,168 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def fingerprint(paragraph):
+    """Fingerprint of a paragraph that ignores case and whitespace differences"""
+    normalized = re.sub(r"\s+", " ", paragraph).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+class IncrementalStore:
+    """Per-report-scope store of seen paragraph fingerprints and earlier chunk analyses
+
+    A scope is one combination of report parameters (industry, analysis type, time focus,
+    detail level, model, custom prompt), so content seen by one kind of report is still
+    new to another.
+    """
+    def __init__(self, path, max_age_days=7, max_analyses=50):
+        self.path = path
+        self.max_age = max_age_days * 86400
+        self.max_analyses = max_analyses
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS seen (
+                scope TEXT NOT NULL,
+                url TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                seen_at REAL NOT NULL,
+                PRIMARY KEY (scope, url, fingerprint)
+            );
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS reports (
+                scope TEXT PRIMARY KEY,
+                text TEXT NOT NULL,
+                visualizations TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def scope_key(industry, analysis_type, time_period, detail_level, model, custom_prompt=""):
+        payload = json.dumps([industry, analysis_type, time_period, detail_level, model, custom_prompt])
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def new_content(self, scope, url, text):
+        """Return (text made of paragraphs not yet seen for this scope and url, their fingerprints)
+
+        Nothing is marked as seen here; call mark_seen once the new content has been analysed.
+        """
+        if not isinstance(text, str) or text.startswith("ERROR:"):
+            return text, []
+
+        with self._lock:
+            seen = {row[0] for row in self._conn.execute(
+                "SELECT fingerprint FROM seen WHERE scope = ? AND url = ?", (scope, url)
+            )}
+
+        new_paragraphs = []
+        new_fingerprints = []
+        for paragraph in text.splitlines():
+            if not paragraph.strip():
+                continue
+            fp = fingerprint(paragraph)
+            if fp in seen:
+                continue
+            seen.add(fp)
+            new_paragraphs.append(paragraph)
+            new_fingerprints.append(fp)
+
+        logger.info(f"{url}: {len(new_paragraphs)} new paragraphs since the last run")
+        return "\n".join(new_paragraphs), new_fingerprints
+
+    def mark_seen(self, scope, url, fingerprints):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO seen (scope, url, fingerprint, seen_at) VALUES (?, ?, ?, ?)",
+                [(scope, url, fp, now) for fp in fingerprints]
+            )
+            self._conn.commit()
+
+    def prior_analyses(self, scope):
+        """Chunk analyses from earlier runs of this scope, oldest first"""
+        with self._lock:
+            self._prune(scope)
+            rows = self._conn.execute(
+                "SELECT analysis FROM analyses WHERE scope = ? ORDER BY id ASC", (scope,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def add_analyses(self, scope, analyses):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO analyses (scope, analysis, created_at) VALUES (?, ?, ?)",
+                [(scope, analysis, now) for analysis in analyses]
+            )
+            self._prune(scope)
+            self._conn.commit()
+
+    def _prune(self, scope):
+        cutoff = time.time() - self.max_age
+        self._conn.execute("DELETE FROM analyses WHERE scope = ? AND created_at < ?", (scope, cutoff))
+        self._conn.execute("DELETE FROM seen WHERE scope = ? AND seen_at < ?", (scope, cutoff))
+        self._conn.execute("""
+            DELETE FROM analyses WHERE scope = ? AND id NOT IN (
+                SELECT id FROM analyses WHERE scope = ? ORDER BY id DESC LIMIT ?
+            )
+        """, (scope, scope, self.max_analyses))
+
+    def last_report(self, scope):
+        """Return the last consolidated report for this scope as {"text", "visualizations"}, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, visualizations FROM reports WHERE scope = ?", (scope,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"text": row[0], "visualizations": json.loads(row[1])}
+
+    def save_report(self, scope, text, visualizations):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO reports (scope, text, visualizations, created_at) VALUES (?, ?, ?, ?)",
+                (scope, text, json.dumps(visualizations), time.time())
+            )
+            self._conn.commit()
+
+    def reset(self, scope=None):
+        """Forget seen content, analyses and reports for one scope, or for every scope"""
+        with self._lock:
+            for table in ("seen", "analyses", "reports"):
+                if scope is None:
+                    self._conn.execute(f"DELETE FROM {table}")
+                else:
+                    self._conn.execute(f"DELETE FROM {table} WHERE scope = ?", (scope,))
+            self._conn.commit()
+
+_incremental_store = None
+_incremental_store_lock = threading.Lock()
+
+def get_incremental_store():
+    """Return the process-wide incremental analysis store"""
+    global _incremental_store
+    with _incremental_store_lock:
+        if _incremental_store is None:
+            _incremental_store = IncrementalStore(
+                path=os.environ.get("INCREMENTAL_STORE_PATH", os.path.join(".llm_cache", "incremental.sqlite3")),
+                max_age_days=float(os.environ.get("INCREMENTAL_MAX_AGE_DAYS", 7)),
+                max_analyses=int(os.environ.get("INCREMENTAL_MAX_ANALYSES", 50))
+            )
+        return _incremental_store
@@ -0,0 +1,252 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from pipeline import ReportPipeline
+from analyze import is_incomplete_analysis
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = ("done", "failed", "cancelled")
+
+# Parameters that change what a report contains; the others (workers, parallelism, timeouts) only change how fast it is made
+REQUEST_KEY_PARAMS = [
+    "industry", "analysis_type", "time_period", "detail_level", "model", "chunk_size", "token_chunking",
+    "incremental", "dedup", "relevance_filter", "relevance_budget"
+]
+
+def normalize_url(url):
+    """Normalise a source URL for comparison: trimmed, lower-case scheme and host, no fragment or trailing slash"""
+    parsed = urlparse(url.strip())
+    path = parsed.path.rstrip("/")
+    normalized = f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{path}"
+    if parsed.query:
+        normalized += f"?{parsed.query}"
+    return normalized
+
+def request_key(params):
+    """Key identifying requests that would produce the same report, whatever order sources were picked in"""
+    key = {name: params.get(name) for name in REQUEST_KEY_PARAMS}
+    key["sources"] = sorted({normalize_url(url) for url in params.get("source_urls", [])})
+    return json.dumps(key, sort_keys=True, default=str)
+
+class JobCancelled(Exception):
+    pass
+
+class ReportJob:
+    """State of one background report run; read it through JobManager.snapshot()"""
+    def __init__(self, job_id, params):
+        self.id = job_id
+        self.params = params
+        self.key = request_key(params)
+        self.status = "queued"
+        self.stage = "Queued"
+        self.progress = 0.0
+        self.messages = []
+        self.chunk_analyses = []
+        self.streamed_text = ""
+        self.report_html = None
+        self.result = None
+        self.timings = []
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        # Lets a cancel reach LLM calls that are queued or streaming inside the analysis
+        self.cancel_event = threading.Event()
+        self.subscribers = set()
+
+class JobManager:
+    """Runs report pipelines on a worker pool and keeps their progress in a process-wide store
+
+    Streamlit reruns the page script on every interaction; the page only holds a job id and
+    polls snapshot(), so a rerun reattaches to the running job instead of restarting it, and
+    runs from different users no longer block each other's script thread.
+
+    Requests are coalesced on request_key(): an identical request joins the matching queued
+    or running job, and one that finished cleanly within result_ttl seconds is served as is.
+    A shared job keeps the ids of the sessions watching it and is only cancelled when the
+    last of them cancels; the others just detach.
+    """
+    def __init__(self, max_workers=2, retention=3600, result_ttl=600):
+        self.retention = retention
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._ids = itertools.count(1)
+
+    def _reusable(self, job, now):
+        """A job an identical request can share: still in flight, or finished cleanly within result_ttl"""
+        if job.status not in FINISHED_STATES:
+            return True
+        if job.status != "done" or now - job.finished_at > self.result_ttl:
+            return False
+        chunk_analyses = (job.result or {}).get("chunk_analyses", [])
+        return not any(is_incomplete_analysis(a) for a in chunk_analyses)
+
+    def submit(self, params, reuse=True, subscriber=None):
+        """Queue a report run with ReportPipeline keyword arguments; returns the job id
+
+        With reuse, an identical in-flight or recent job is returned instead of starting a new run.
+        subscriber (e.g. a session id) is recorded as watching the returned job.
+        """
+        key = request_key(params)
+        now = time.time()
+        with self._lock:
+            self._prune()
+            if reuse:
+                matches = [job for job in self._jobs.values() if job.key == key and self._reusable(job, now)]
+                if matches:
+                    job = max(matches, key=lambda job: job.created_at)
+                    if subscriber is not None:
+                        job.subscribers.add(subscriber)
+                    logger.info(f"Coalesced request into {job.status} job {job.id} ({len(job.subscribers)} subscribers)")
+                    return job.id
+            job = ReportJob(f"job-{next(self._ids)}-{int(time.time())}", params)
+            if subscriber is not None:
+                job.subscribers.add(subscriber)
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job)
+        logger.info(f"Submitted report job {job.id}")
+        return job.id
+
+    def snapshot(self, job_id):
+        """Return a copy of the job's state as a dict, or None for an unknown or expired job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            state = dict(vars(job))
+            del state["cancel_event"]
+            state["messages"] = list(job.messages)
+            state["chunk_analyses"] = list(job.chunk_analyses)
+            state["timings"] = list(job.timings)
+            state["subscribers"] = len(job.subscribers)
+            return state
+
+    def detach(self, job_id, subscriber):
+        """Stop watching a job without cancelling it"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.subscribers.discard(subscriber)
+
+    def cancel(self, job_id, subscriber=None):
+        """Ask a job to stop; a running analysis aborts its in-flight LLM requests
+
+        With a subscriber, the job is only cancelled if no other subscriber is watching it;
+        otherwise the subscriber is just detached. Returns True if the job was cancelled.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            if subscriber is not None:
+                job.subscribers.discard(subscriber)
+                if job.subscribers:
+                    logger.info(f"Detached a subscriber from job {job.id}; {len(job.subscribers)} still watching")
+                    return False
+            job.cancel_requested = True
+            job.cancel_event.set()
+            return True
+
+    def _update(self, job, **fields):
+        with self._lock:
+            for name, value in fields.items():
+                setattr(job, name, value)
+
+    def _message(self, job, level, text):
+        with self._lock:
+            job.messages.append((level, text))
+
+    def _check_cancelled(self, job):
+        if job.cancel_requested:
+            raise JobCancelled()
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        pipeline = None
+        try:
+            self._check_cancelled(job)
+            self._update(job, status="running", stage="Scraping content from sources...")
+            pipeline = ReportPipeline(**job.params)
+            total_sources = len(pipeline.source_urls)
+
+            completed = 0
+            for i, source_name, error in pipeline.scrape():
+                completed += 1
+                if error is not None:
+                    self._message(job, "error", f"Error processing {source_name}: {str(error)}")
+                self._update(job, stage=f"Processed {source_name} ({completed}/{total_sources})",
+                             progress=0.4 * completed / total_sources)
+                self._check_cancelled(job)
+
+            filter_stats = pipeline.filter()
+            if filter_stats.get("dedup", {}).get("paragraphs_dropped"):
+                self._message(job, "info", f"Removed {filter_stats['dedup']['paragraphs_dropped']} near-duplicate paragraphs "
+                                           f"(about {filter_stats['dedup']['tokens_saved']:,} tokens).")
+            if filter_stats.get("relevance", {}).get("tokens_saved"):
+                relevance_stats = filter_stats["relevance"]
+                self._message(job, "info", f"Kept {relevance_stats['paragraphs_out']} of {relevance_stats['paragraphs_in']} paragraphs "
+                                           f"relevant to {pipeline.industry} ({relevance_stats['tokens_out']:,} of {relevance_stats['tokens_in']:,} tokens).")
+            self._update(job, stage="Analyzing with LLM...", progress=0.4)
+
+            analysis = pipeline.analyze(cancel=job.cancel_event)
+            try:
+                for event in analysis:
+                    if event["type"] == "chunk":
+                        with self._lock:
+                            job.chunk_analyses.append(event["text"])
+                            job.stage = f"Analyzed chunk {event['index']} of {event['total']}"
+                            job.progress = 0.4 + 0.5 * len(job.chunk_analyses) / event["total"]
+                    elif event["type"] == "status":
+                        self._update(job, stage=f"{event['message']}...")
+                    elif event["type"] == "token":
+                        with self._lock:
+                            job.streamed_text += event["text"]
+                    self._check_cancelled(job)
+            finally:
+                # Closing the stream aborts in-flight requests when the job is cancelled
+                analysis.close()
+
+            if pipeline.from_previous_run:
+                self._message(job, "info", "No new articles since the last run; showing the previous report.")
+            report_html = pipeline.render()
+            self._update(job, status="done", stage="Analysis complete!", progress=1.0,
+                         result=pipeline.result, report_html=report_html)
+        except JobCancelled:
+            logger.info(f"Report job {job.id} cancelled")
+            self._update(job, status="cancelled", stage="Cancelled")
+        except Exception as e:
+            logger.error(f"Report job {job.id} failed: {str(e)}")
+            self._update(job, status="failed", stage="Failed", error=str(e))
+        finally:
+            self._update(job, finished_at=time.time(),
+                         timings=pipeline.timer.summary() if pipeline is not None else [])
+
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+def get_job_manager():
+    """Return the process-wide report job manager"""
+    global _job_manager
+    with _job_manager_lock:
+        if _job_manager is None:
+            _job_manager = JobManager(
+                max_workers=int(os.environ.get("REPORT_JOB_WORKERS", 2)),
+                retention=float(os.environ.get("REPORT_JOB_RETENTION", 3600)),
+                result_ttl=float(os.environ.get("REPORT_RESULT_TTL", 600))
+            )
+        return _job_manager
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class LLMResponseCache:
+    """Persistent SQLite cache of LLM responses with size limits and LRU eviction
+
+    Entries are keyed by (model, template hash, prompt variables), where the prompt
+    variables include the chunk content, so only new or changed chunks miss the cache.
+    """
+    def __init__(self, path, max_entries=5000, max_bytes=100 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                template_hash TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, template, params):
+        """Stable key for a prompt: model name, template hash and the template variables"""
+        payload = json.dumps({
+            "model": model,
+            "template": _sha256(template),
+            "params": params
+        }, sort_keys=True, default=str)
+        return _sha256(payload)
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, model, template, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, template_hash, response, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, _sha256(template), response, len(response.encode("utf-8")), now, now)
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        evicted = 0
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access ASC").fetchall()
+        for key, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+            evicted += 1
+        logger.info(f"Evicted {evicted} entries from LLM response cache")
+
+    def invalidate(self, key=None, model=None, template=None):
+        """Delete one key, every entry for a model and/or template, or everything when no filter is given"""
+        clauses = []
+        values = []
+        if key is not None:
+            clauses.append("key = ?")
+            values.append(key)
+        if model is not None:
+            clauses.append("model = ?")
+            values.append(model)
+        if template is not None:
+            clauses.append("template_hash = ?")
+            values.append(_sha256(template))
+
+        query = "DELETE FROM responses"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        with self._lock:
+            deleted = self._conn.execute(query, values).rowcount
+            self._conn.commit()
+        logger.info(f"Invalidated {deleted} LLM response cache entries")
+        return deleted
+
+    def stats(self):
+        with self._lock:
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": total, "max_entries": self.max_entries, "max_bytes": self.max_bytes}
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+def get_llm_cache():
+    """Return the process-wide LLM response cache, or None when LLM_CACHE=0"""
+    global _llm_cache
+    if os.environ.get("LLM_CACHE", "1") == "0":
+        return None
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            _llm_cache = LLMResponseCache(
+                path=os.environ.get("LLM_CACHE_PATH", os.path.join(".llm_cache", "responses.sqlite3")),
+                max_entries=int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 5000)),
+                max_bytes=int(float(os.environ.get("LLM_CACHE_MAX_MB", 100)) * 1024 * 1024)
+            )
+        return _llm_cache
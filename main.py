@@ -5,17 +5,14 @@ import urllib.parse
 import logging
 import time
 import os
-import requests
+import httpx
 import random
-from scrape import (
-    scrape_website,
-    extract_body_content,
-    clean_body_content,
-    split_dom_content,
-    get_healthcare_sources,
-    get_finance_sources
-)
-from analyze import analyze_trends_with_ollama
+import uuid
+from scrape import get_industry_sources, name_sources
+from jobs import get_job_manager
+from scheduler import get_llm_scheduler
+from ollama_client import get_ollama_pool
+from analyze import get_model_registry, DEFAULT_MAX_PARALLEL, DEFAULT_REPORT_BUDGET
 import datetime
 
 # Set up logging
@@ -51,14 +48,11 @@ def check_ollama_connection():
     }
     
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
-        if response.status_code == 200:
-            ollama_status["connected"] = True
-            ollama_status["models"] = [model["name"] for model in response.json().get("models", [])]
-        else:
-            ollama_status["error"] = f"Ollama API returned status code {response.status_code}"
-    except requests.exceptions.RequestException as e:
+        ollama_status["models"] = get_ollama_pool().available_models(refresh=True)
+        ollama_status["connected"] = True
+    except httpx.HTTPError as e:
         ollama_status["error"] = f"Cannot connect to Ollama server: {str(e)}"
+    ollama_status["servers"] = get_ollama_pool().stats()
     
     return ollama_status
 
@@ -75,49 +69,27 @@ if 'clear_gpu_memory' not in st.session_state:
     st.session_state['clear_gpu_memory'] = True
 if 'selected_model' not in st.session_state:
     st.session_state['selected_model'] = "llama3:latest"
-
-# Define industry options and their sources
-def get_industry_sources():
-    return {
-        "Healthcare": {
-            "description": "Healthcare technology, medical devices, biotech, and digital health",
-            "sources": get_healthcare_sources()
-        },
-        "Finance": {
-            "description": "Fintech, banking technology, investment platforms, and financial services",
-            "sources": get_finance_sources()
-        },
-        "Technology": {
-            "description": "Software development, cloud computing, AI/ML, and enterprise solutions",
-            "sources": {
-                "TechCrunch": "https://techcrunch.com/",
-                "The Verge": "https://www.theverge.com/",
-                "Wired": "https://www.wired.com/",
-                "VentureBeat": "https://venturebeat.com/",
-                "MIT Technology Review": "https://www.technologyreview.com/"
-            }
-        },
-        "E-commerce": {
-            "description": "Online retail, marketplaces, D2C brands, and retail technology",
-            "sources": {
-                "Retail Dive": "https://www.retaildive.com/",
-                "Digital Commerce 360": "https://www.digitalcommerce360.com/",
-                "Shopify Blog": "https://www.shopify.com/blog",
-                "eMarketer": "https://www.emarketer.com/",
-                "Internet Retailer": "https://www.digitalcommerce360.com/internet-retailer/"
-            }
-        },
-        "Energy": {
-            "description": "Renewable energy, clean tech, energy storage, and sustainability",
-            "sources": {
-                "Greentech Media": "https://www.greentechmedia.com/",
-                "CleanTechnica": "https://cleantechnica.com/",
-                "Energy News Network": "https://energynews.us/",
-                "Renewable Energy World": "https://www.renewableenergyworld.com/",
-                "Bloomberg Green": "https://www.bloomberg.com/green"
-            }
-        }
-    }
+if 'scrape_workers' not in st.session_state:
+    st.session_state['scrape_workers'] = 4
+if 'token_chunking' not in st.session_state:
+    st.session_state['token_chunking'] = True
+if 'llm_parallel' not in st.session_state:
+    st.session_state['llm_parallel'] = DEFAULT_MAX_PARALLEL
+if 'incremental_mode' not in st.session_state:
+    st.session_state['incremental_mode'] = False
+if 'dedup_content' not in st.session_state:
+    st.session_state['dedup_content'] = True
+if 'relevance_filter' not in st.session_state:
+    st.session_state['relevance_filter'] = True
+if 'relevance_budget' not in st.session_state:
+    st.session_state['relevance_budget'] = 0
+if 'session_id' not in st.session_state:
+    st.session_state['session_id'] = uuid.uuid4().hex
+if 'reuse_reports' not in st.session_state:
+    st.session_state['reuse_reports'] = True
+if 'report_budget' not in st.session_state:
+    # Round up so a budget under a minute is not shown as 0 (none)
+    st.session_state['report_budget'] = int(-(-DEFAULT_REPORT_BUDGET // 60))
 
 # Configure page with removed top padding
 st.set_page_config(
@@ -449,6 +421,59 @@ with tab2:
         )
         st.session_state.content_chunk_size = content_size
         
+        token_chunking = st.checkbox(
+            "Size Chunks to Model Context Window",
+            value=st.session_state.token_chunking,
+            key="token_chunking_checkbox",
+            help="Pack each chunk up to the model's context window minus the prompt template, instead of using the character chunk size"
+        )
+        st.session_state.token_chunking = token_chunking
+        
+        incremental_mode = st.checkbox(
+            "Incremental Mode (Only Analyze New Articles)",
+            value=st.session_state.incremental_mode,
+            key="incremental_mode_checkbox",
+            help="Only send paragraphs not seen in earlier runs of the same report to the model, and merge them with the earlier findings"
+        )
+        st.session_state.incremental_mode = incremental_mode
+        
+        dedup_content = st.checkbox(
+            "Remove Near-Duplicate Paragraphs",
+            value=st.session_state.dedup_content,
+            key="dedup_content_checkbox",
+            help="Syndicated stories often appear on several sources; analyze each one only once"
+        )
+        st.session_state.dedup_content = dedup_content
+        
+        reuse_reports = st.checkbox(
+            "Share Identical Report Requests",
+            value=st.session_state.reuse_reports,
+            key="reuse_reports_checkbox",
+            help="Join a matching report that is already running, or show one generated in the last few minutes, instead of starting a new run"
+        )
+        st.session_state.reuse_reports = reuse_reports
+        
+        relevance_filter = st.checkbox(
+            "Send Only Industry-Relevant Text",
+            value=st.session_state.relevance_filter,
+            key="relevance_filter_checkbox",
+            help="Score paragraphs against the industry's keyword profile and drop navigation, tickers and unrelated stories"
+        )
+        st.session_state.relevance_filter = relevance_filter
+        
+        if relevance_filter:
+            st.markdown("<div style='margin: 10px 0 5px 0; font-weight: 500; color: #475569;'>Relevant Text Budget (thousand tokens, 0 = no cap)</div>", unsafe_allow_html=True)
+            relevance_budget = st.slider(
+                "",
+                min_value=0,
+                max_value=200,
+                value=st.session_state.relevance_budget,
+                step=5,
+                key="relevance_budget_slider",
+                label_visibility="collapsed"
+            )
+            st.session_state.relevance_budget = relevance_budget
+        
         # Model Selection
         st.markdown("<div style='margin: 20px 0 5px 0; font-weight: 500; color: #475569;'>Model Selection</div>", unsafe_allow_html=True)
         
@@ -481,6 +506,21 @@ with tab2:
         )
         st.session_state.analysis_timeout = analysis_timeout
         
+        # End-to-end budget for the whole report
+        st.markdown("<div style='margin: 20px 0 5px 0; font-weight: 500; color: #475569;'>Report Time Budget (minutes, 0 = none)</div>", unsafe_allow_html=True)
+        
+        report_budget = st.slider(
+            "",
+            min_value=0,
+            max_value=max(60, st.session_state.report_budget),
+            value=st.session_state.report_budget,
+            step=1,
+            key="report_budget_slider",
+            label_visibility="collapsed",
+            help="Requests still running when the budget runs out are aborted on the Ollama server"
+        )
+        st.session_state.report_budget = report_budget
+        
         # Clear GPU Memory checkbox
         st.markdown("<div style='margin: 20px 0 10px 0;'></div>", unsafe_allow_html=True)
         clear_gpu = st.checkbox(
@@ -489,6 +529,41 @@ with tab2:
             key="clear_gpu_checkbox"
         )
         st.session_state.clear_gpu_memory = clear_gpu
+        
+        # Concurrent scraping workers
+        st.markdown("<div style='margin: 20px 0 5px 0; font-weight: 500; color: #475569;'>Scraping Workers</div>", unsafe_allow_html=True)
+        
+        scrape_workers = st.slider(
+            "",
+            min_value=1,
+            max_value=8,
+            value=st.session_state.scrape_workers,
+            step=1,
+            key="scrape_workers_slider",
+            label_visibility="collapsed"
+        )
+        st.session_state.scrape_workers = scrape_workers
+        
+        # Concurrent LLM requests
+        st.markdown("<div style='margin: 20px 0 5px 0; font-weight: 500; color: #475569;'>Parallel LLM Requests</div>", unsafe_allow_html=True)
+        
+        llm_parallel = st.slider(
+            "",
+            min_value=1,
+            max_value=max(8, DEFAULT_MAX_PARALLEL, st.session_state.llm_parallel),
+            value=st.session_state.llm_parallel,
+            step=1,
+            key="llm_parallel_slider",
+            label_visibility="collapsed",
+            help="Match OLLAMA_NUM_PARALLEL times the number of Ollama servers"
+        )
+        st.session_state.llm_parallel = llm_parallel
+        
+        # The process-wide scheduler limit applies on top of the per-report setting
+        llm_limit = get_llm_scheduler().max_in_flight
+        if llm_limit is not None and llm_parallel > llm_limit:
+            st.caption(f"At most {llm_limit} LLM requests run at once across all reports (LLM_MAX_IN_FLIGHT, by default "
+                       f"OLLAMA_NUM_PARALLEL times the number of servers); the rest wait in the queue.")
     
     st.markdown("</div>", unsafe_allow_html=True)
     
@@ -578,6 +653,15 @@ with tab2:
             </div>
             """, unsafe_allow_html=True)
         
+        # With several servers in OLLAMA_HOSTS, show how requests are spread across them
+        servers = ollama_status.get("servers", [])
+        if len(servers) > 1:
+            with st.expander(f"Ollama Servers ({sum(server['healthy'] for server in servers)}/{len(servers)} up)"):
+                for server in servers:
+                    status = "🟢" if server["healthy"] else f"🔴 {server['error']}"
+                    st.markdown(f"{status} `{server['url']}` — {len(server['models'])} models, "
+                                f"{server['dispatched']} requests served")
+        
         # Fun action buttons
         st.markdown("""
         <div style="display: flex; gap: 15px; margin-top: 20px;">
@@ -593,8 +677,7 @@ with tab2:
         
         with col2:
             if st.button("🧹 Clear Model Cache", use_container_width=True):
-                st.info("Clearing model cache...")
-                time.sleep(1.5)
+                get_model_registry().invalidate()
                 st.success("Cache cleared successfully!")
         
         st.markdown("</div></div>", unsafe_allow_html=True)
@@ -729,192 +812,103 @@ if generate_button:
     if not source_urls:
         st.warning("Please select at least one news source to analyze.")
     else:
-        # Create a progress container
-        progress_container = st.container()
+        source_names = name_sources(source_urls, sources)
         
-        with progress_container:
-            st.markdown("## Generating Industry Analysis Report")
-            st.markdown("#### Processing content from selected sources...")
-            
-            # Set up progress tracking
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # Process each source
-            total_sources = len(source_urls)
-            scraped_content = []
-            
-            for i, url in enumerate(source_urls):
-                source_name = next((name for name, src_url in sources.items() if src_url == url), f"Custom URL {i+1}")
-                status_text.markdown(f"Scraping content from **{source_name}**...")
-                
-                try:
-                    # Scrape website
-                    html_content = scrape_website(url)
-                    
-                    # Extract body content
-                    status_text.markdown(f"Extracting content from **{source_name}**...")
-                    body_content = extract_body_content(html_content)
-                    
-                    # Clean content
-                    status_text.markdown(f"Processing content from **{source_name}**...")
-                    cleaned_content = clean_body_content(body_content)
-                    
-                    # Split content into chunks
-                    content_chunks = split_dom_content(cleaned_content, chunk_size=st.session_state.content_chunk_size)
-                    
-                    # Add to scraped content
-                    for chunk in content_chunks:
-                        scraped_content.append({
-                            "source": source_name,
-                            "url": url,
-                            "content": chunk
-                        })
-                    
-                    # Update progress
-                    progress_bar.progress((i + 1) / total_sources)
-                    time.sleep(0.5)  # Simulate processing time
-                    
-                except Exception as e:
-                    st.error(f"Error processing {source_name}: {str(e)}")
-                    logger.error(f"Error processing {url}: {str(e)}")
-            
-            # Set progress to complete
-            progress_bar.progress(1.0)
-            status_text.markdown("Content processing complete! Analyzing with LLM...")
-            
-            # Handle generation when button is clicked
-if generate_button:
-    # Get selected source URLs
-    source_urls = [sources[source] for source in selected_sources] + custom_urls
-    
-    if not source_urls:
-        st.warning("Please select at least one news source to analyze.")
-    else:
-        # Create a progress container
-        progress_container = st.container()
+        # Run the report in the background; this page only keeps the job id and polls it
+        previous_job_id = st.session_state.get("report_job_id")
+        st.session_state.report_job_id = get_job_manager().submit({
+            "source_urls": source_urls,
+            "source_names": source_names,
+            "industry": industry,
+            "analysis_type": analysis_type,
+            "time_period": time_period,
+            "detail_level": report_detail,
+            "model": st.session_state.selected_model,
+            "chunk_size": st.session_state.content_chunk_size,
+            "scrape_workers": st.session_state.scrape_workers,
+            "token_chunking": st.session_state.token_chunking,
+            "llm_parallel": st.session_state.llm_parallel,
+            "timeout": st.session_state.analysis_timeout,
+            "budget": st.session_state.report_budget * 60,
+            "incremental": st.session_state.incremental_mode,
+            "dedup": st.session_state.dedup_content,
+            "relevance_filter": st.session_state.relevance_filter,
+            "relevance_budget": st.session_state.relevance_budget * 1000
+        }, reuse=st.session_state.reuse_reports, subscriber=st.session_state.session_id)
+        if previous_job_id and previous_job_id != st.session_state.report_job_id:
+            # Stop counting as a viewer of the old report so others watching it can still cancel it
+            get_job_manager().detach(previous_job_id, st.session_state.session_id)
+
+# Show the current report job; reruns reattach to it instead of starting a new run
+report_job = get_job_manager().snapshot(st.session_state.report_job_id) if st.session_state.get("report_job_id") else None
+if report_job is not None:
+    # Create a progress container
+    progress_container = st.container()
+    
+    with progress_container:
+        st.markdown("## Generating Industry Analysis Report")
+        st.progress(report_job["progress"])
+        st.markdown(report_job["stage"])
         
-        with progress_container:
-            st.markdown("## Generating Industry Analysis Report")
-            st.markdown("#### Processing content from selected sources...")
-            
-            # Set up progress tracking
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            # Process each source
-            total_sources = len(source_urls)
-            scraped_content = []
-            
-            for i, url in enumerate(source_urls):
-                source_name = next((name for name, src_url in sources.items() if src_url == url), f"Custom URL {i+1}")
-                status_text.markdown(f"Scraping content from **{source_name}**...")
-                
+        for level, message in report_job["messages"]:
+            if level == "error":
+                st.error(message)
+            else:
+                st.info(message)
+        
+        if report_job["chunk_analyses"]:
+            with st.expander("Chunk analyses as they finish", expanded=False):
+                for chunk_analysis in report_job["chunk_analyses"]:
+                    st.markdown(chunk_analysis)
+        
+        if report_job["status"] in ("queued", "running"):
+            queue_stats = get_llm_scheduler().stats()
+            st.caption(f"LLM queue: {queue_stats['in_flight']} calls running, {queue_stats['queue_depth']} waiting "
+                       f"(recent wait {queue_stats['wait_seconds']['mean']:.1f}s on average)")
+            if report_job["subscribers"] > 1:
+                st.caption(f"{report_job['subscribers']} people are waiting for this report")
+            if st.button("Cancel Report", key="cancel_report_job"):
+                # Shared reports keep running for the others; this page just stops following it
+                if not get_job_manager().cancel(report_job["id"], subscriber=st.session_state.session_id):
+                    st.session_state.report_job_id = None
+                st.rerun()
+            if report_job["streamed_text"]:
+                st.markdown(report_job["streamed_text"])
+            # Poll the background job
+            time.sleep(1)
+            st.rerun()
+        
+        elif report_job["status"] == "done":
+            # Clear GPU memory once per finished job if option is selected
+            if st.session_state.clear_gpu_memory and st.session_state.system_resources.get("cuda_available", False) \
+                    and st.session_state.get("gpu_cleared_job") != report_job["id"]:
+                st.session_state.gpu_cleared_job = report_job["id"]
                 try:
-                    # Scrape website
-                    html_content = scrape_website(url)
-                    
-                    # Extract body content
-                    status_text.markdown(f"Extracting content from **{source_name}**...")
-                    body_content = extract_body_content(html_content)
-                    
-                    # Clean content
-                    status_text.markdown(f"Processing content from **{source_name}**...")
-                    cleaned_content = clean_body_content(body_content)
-                    
-                    # Split content into chunks
-                    content_chunks = split_dom_content(cleaned_content, chunk_size=st.session_state.content_chunk_size)
-                    
-                    # Add to scraped content
-                    for chunk in content_chunks:
-                        scraped_content.append({
-                            "source": source_name,
-                            "url": url,
-                            "content": chunk
-                        })
-                    
-                    # Update progress
-                    progress_bar.progress((i + 1) / total_sources)
-                    time.sleep(0.5)  # Simulate processing time
-                    
-                except Exception as e:
-                    st.error(f"Error processing {source_name}: {str(e)}")
-                    logger.error(f"Error processing {url}: {str(e)}")
-            
-            # Set progress to complete
-            progress_bar.progress(1.0)
-            status_text.markdown("Content processing complete! Analyzing with LLM...")
+                    import torch
+                    torch.cuda.empty_cache()
+                    logger.info("GPU memory cleared")
+                except:
+                    logger.warning("Could not clear GPU memory")
             
-            # Start analysis with LLM
+            # Show results
+            st.success("Analysis complete!")
             try:
-                with st.spinner("Generating market insights with AI model..."):
-                    # Get analysis results
-                    analysis_result = analyze_trends_with_ollama(
-                        scraped_content,
-                        industry=industry,
-                        analysis_type=analysis_type,
-                        time_period=time_period,
-                        detail_level=report_detail,
-                        model=st.session_state.selected_model,
-                        timeout=st.session_state.analysis_timeout
-                    )
-                    
-                    # Safely extract results regardless of return type
-                    if isinstance(analysis_result, dict):
-                        analysis_text = analysis_result.get('analysis_text', '')
-                        visualization_data = analysis_result.get('visualization_data', {})
-                        html_report = analysis_result.get('html_report', '')
-                    elif isinstance(analysis_result, (tuple, list)) and len(analysis_result) >= 3:
-                        analysis_text = analysis_result[0]
-                        visualization_data = analysis_result[1]
-                        html_report = analysis_result[2]
-                    else:
-                        analysis_text = str(analysis_result)
-                        visualization_data = {}
-                        html_report = ''
-                    
-                    # Ensure analysis_text is always a string
-                    if not isinstance(analysis_text, str):
-                        analysis_text = str(analysis_text)
-                    
-                    # Clear GPU memory if option is selected
-                    if st.session_state.clear_gpu_memory and st.session_state.system_resources.get("cuda_available", False):
-                        try:
-                            import torch
-                            torch.cuda.empty_cache()
-                            logger.info("GPU memory cleared")
-                        except:
-                            logger.warning("Could not clear GPU memory")
-                
-                # Show results
-                st.success("Analysis complete!")
-                
-                # Format report date
-                report_date = datetime.datetime.now().strftime("%B %d, %Y")
-                
-                # Display results with absolute type safety
-                try:
-                    display_content = f"""
-                    <div style="background-color: white; padding: 25px; border-radius: 12px; box-shadow: 0 4px 10px rgba(0, 0, 0, 0.1); margin-top: 20px;">
-                        <div style="border-bottom: 1px solid #e2e8f0; padding-bottom: 15px; margin-bottom: 20px;">
-                            <div style="font-size: 1.5rem; font-weight: 700; color: #1e293b; margin-bottom: 5px;">
-                                {industry} Industry Analysis Report
-                            </div>
-                            <div style="font-size: 0.9rem; color: #64748b;">
-                                Generated on {report_date} | Analysis Type: {analysis_type} | Time Focus: {time_period}
-                            </div>
-                        </div>
-                        <div style="font-size: 1.1rem; line-height: 1.7; color: #334155;">
-                            {analysis_text}
-                        </div>
-                    </div>
-                    """
-                    st.markdown(display_content, unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"Error displaying results: {str(e)}")
-                    logger.error(f"Display error: {str(e)}")
-                    st.text_area("Analysis Results", value=str(analysis_text), height=400)
-
+                st.markdown(report_job["report_html"], unsafe_allow_html=True)
             except Exception as e:
-                st.error(f"Error during analysis: {str(e)}")
-                logger.error(f"Analysis error: {str(e)}")
\ No newline at end of file
+                st.error(f"Error displaying results: {str(e)}")
+                logger.error(f"Display error: {str(e)}")
+                st.text_area("Analysis Results", value=str(report_job["result"]), height=400)
+            
+            # Per-stage timings for this run
+            with st.expander("Pipeline timings", expanded=False):
+                st.table({
+                    "Stage": [name for name, _ in report_job["timings"]],
+                    "Seconds": [f"{seconds:.2f}" for _, seconds in report_job["timings"]]
+                })
+                st.caption("Fetch, extract, clean and chunk are summed over all sources, which are processed concurrently.")
+        
+        elif report_job["status"] == "cancelled":
+            st.warning("Report generation was cancelled.")
+        
+        else:
+            st.error(f"Error during analysis: {report_job['error']}")
\ No newline at end of file
@@ -0,0 +1,358 @@
+import contextvars
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def _base_url(host):
+    """Normalise an OLLAMA_HOST value such as "localhost:11434" to a base URL"""
+    host = host.strip().rstrip("/")
+    if "://" not in host:
+        host = f"http://{host}"
+    return host
+
+# Deadline and cancel event of the LLM call being started on this thread; set with call_deadline()
+_call_deadline = contextvars.ContextVar("ollama_call_deadline", default=None)
+
+@contextmanager
+def call_deadline(deadline, cancel=None):
+    """Stop requests sent inside the block when deadline passes or the cancel event is set
+
+    deadline needs remaining(); either may be None.
+    """
+    token = _call_deadline.set((deadline, cancel))
+    try:
+        yield
+    finally:
+        _call_deadline.reset(token)
+
+class _Watchdog:
+    """Shuts down the connection of one request once its deadline passes or its cancel event is set
+
+    Shutting the socket down wakes a read blocked in another thread, so the request fails
+    with a transport error straight away, both while Ollama evaluates the prompt and when
+    a stream stalls between tokens. Ollama then drops the generation.
+    """
+    def __init__(self, transport, request, deadline, cancel, poll_interval=0.25):
+        self.transport = transport
+        self.request = request
+        self.deadline = deadline
+        self.cancel = cancel
+        self.poll_interval = poll_interval
+        self.network_stream = None
+        self.fired = False
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ollama-watchdog")
+        self._thread.start()
+
+    def _socket(self):
+        stream = self.network_stream
+        if stream is None:
+            # No response yet: find the connection the pool gave this request
+            pool = getattr(self.transport, "_pool", None)
+            for pool_request in list(getattr(pool, "_requests", ())):
+                if pool_request.request.extensions is self.request.extensions:
+                    connection = getattr(pool_request.connection, "_connection", None)
+                    stream = getattr(connection, "_network_stream", None)
+        return stream.get_extra_info("socket") if stream is not None else None
+
+    def _run(self):
+        while True:
+            remaining = self.deadline.remaining() if self.deadline is not None else float("inf")
+            if self._stopped.wait(min(self.poll_interval, remaining)):
+                return
+            if not self.fired:
+                expired = self.deadline is not None and self.deadline.remaining() <= 0
+                self.fired = expired or (self.cancel is not None and self.cancel.is_set())
+                if not self.fired:
+                    continue
+            # Keep trying until the request has a connection to shut down or it ends
+            sock = self._socket()
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                return
+
+    def stop(self):
+        self._stopped.set()
+
+class _WatchedStream(httpx.SyncByteStream):
+    """Response body that stops its request's watchdog when it is closed"""
+    def __init__(self, stream, watchdog):
+        self.stream = stream
+        self.watchdog = watchdog
+
+    def __iter__(self):
+        for part in self.stream:
+            yield part
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self.watchdog.stop()
+
+class DeadlineTransport(httpx.BaseTransport):
+    """Transport wrapper applying call_deadline() to each request
+
+    Ollama sends nothing while it evaluates the prompt, so without this a request only gives
+    up after the client's fixed read timeout, whatever the caller's deadline. The read
+    timeout is capped at the time left, and a watchdog closes the connection when the
+    deadline passes or the call is cancelled, also in the middle of a stream. Models are
+    shared between calls, so this is applied here per request.
+    """
+    def __init__(self, transport):
+        self.transport = transport
+
+    def handle_request(self, request):
+        deadline, cancel = _call_deadline.get() or (None, None)
+        if deadline is None and cancel is None:
+            return self.transport.handle_request(request)
+        
+        remaining = deadline.remaining() if deadline is not None else float("inf")
+        if remaining != float("inf"):
+            timeout = dict(request.extensions.get("timeout", {}))
+            read = timeout.get("read")
+            remaining = max(remaining, 0.001)
+            timeout["read"] = remaining if read is None else min(read, remaining)
+            request.extensions["timeout"] = timeout
+        
+        watchdog = _Watchdog(self.transport, request, deadline, cancel)
+        try:
+            response = self.transport.handle_request(request)
+        except BaseException:
+            watchdog.stop()
+            raise
+        watchdog.network_stream = response.extensions.get("network_stream")
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_WatchedStream(response.stream, watchdog),
+            extensions=response.extensions
+        )
+
+    def close(self):
+        self.transport.close()
+
+class OllamaClient:
+    """Shared keep-alive connection pool for all traffic to one Ollama server
+
+    Control calls (/api/tags, /api/show) go through request(), which retries connection
+    errors and 5xx responses with exponential backoff. LangChain models use the same pool
+    through llm_kwargs(). At most max_connections requests are open at once; further
+    requests wait for a free connection instead of opening new sockets.
+    """
+    def __init__(self, base_url, max_connections=8, retries=3, backoff=0.5, timeout=5):
+        self.base_url = _base_url(base_url)
+        self.retries = retries
+        self.backoff = backoff
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        # The transport owns the pool and every client built on it shares it. It does not retry
+        # connects itself: request() retries control calls, and LLM calls fail over to another server
+        self.transport = DeadlineTransport(httpx.HTTPTransport(limits=limits))
+        self._client = httpx.Client(base_url=self.base_url, transport=self.transport, timeout=timeout)
+
+    def request(self, method, path, retries=None, **kwargs):
+        """Send a request, retrying connection errors and server errors; raises httpx.HTTPError"""
+        retries = self.retries if retries is None else retries
+        for attempt in range(retries + 1):
+            try:
+                response = self._client.request(method, path, **kwargs)
+                if response.status_code < 500 or attempt == retries:
+                    return response
+                logger.warning(f"Ollama {method} {path} returned {response.status_code} (attempt {attempt + 1})")
+            except httpx.TransportError as e:
+                if attempt == retries:
+                    raise
+                logger.warning(f"Ollama {method} {path} failed: {str(e)} (attempt {attempt + 1})")
+            time.sleep(self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def llm_kwargs(self, read_timeout=None):
+        """Keyword arguments for OllamaLLM so its requests go through this pool"""
+        return {
+            "base_url": self.base_url,
+            # No pool timeout: waiting for a free connection is the concurrency bound, not a failure
+            "client_kwargs": {"timeout": httpx.Timeout(read_timeout, pool=None)},
+            # Only the synchronous client can share an HTTPTransport
+            "sync_client_kwargs": {"transport": self.transport}
+        }
+
+    def close(self):
+        self._client.close()
+        self.transport.close()
+
+def is_backend_failure(error):
+    """Whether an error from an Ollama call means the server itself is down or failing"""
+    # The ollama package turns connect errors into ConnectionError and 5xx responses into ResponseError.
+    # A read timeout only means this call was slow (a long prompt, a busy server), not that the server is down
+    if isinstance(error, httpx.TimeoutException) and not isinstance(error, httpx.ConnectTimeout):
+        return False
+    return isinstance(error, (ConnectionError, httpx.TransportError)) or (getattr(error, "status_code", None) or 0) >= 500
+
+class OllamaBackend:
+    """One Ollama server in the pool with its last known health and installed models"""
+    def __init__(self, client):
+        self.client = client
+        self.healthy = False
+        self.models = set()
+        self.error = None
+        self.checked_at = None
+        self.checking = False
+        self.outstanding = 0
+        self.dispatched = 0
+
+    def has_model(self, model_name):
+        """Whether the server lists model_name, matching on the name without its tag like ModelRegistry.resolve"""
+        return model_name.split(':')[0] in {m.split(':')[0] for m in self.models}
+
+class OllamaPool:
+    """Routes Ollama traffic across one or more servers
+
+    Each server's /api/tags is re-read at most every health_ttl seconds, which both checks
+    it is up and records which models it has. Requests go to the healthy server with the
+    model that has the fewest outstanding requests. A server that fails a request is
+    marked down and left alone until its next health check.
+    """
+    def __init__(self, hosts, health_ttl=30, health_timeout=2, max_connections=8, retries=3):
+        self.health_ttl = health_ttl
+        self.health_timeout = health_timeout
+        self.backends = [OllamaBackend(OllamaClient(host, max_connections=max_connections, retries=retries)) for host in hosts]
+        self._lock = threading.Lock()
+        self._checked = threading.Condition(self._lock)
+
+    def check_health(self, force=False):
+        """Refresh the health and model list of servers not checked within health_ttl
+
+        Servers another thread is already checking are skipped, except that a caller waits
+        for the first check of a server, so it does not see it as down before it is known.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stale = [b for b in self.backends if not b.checking and
+                     (force or b.checked_at is None or now - b.checked_at >= self.health_ttl)]
+            for backend in stale:
+                backend.checking = True
+        
+        for backend in stale:
+            healthy, models, error = False, set(), None
+            try:
+                response = backend.client.get("/api/tags", retries=0, timeout=self.health_timeout)
+                if response.status_code == 200:
+                    healthy = True
+                    models = {model["name"] for model in response.json().get("models", [])}
+                else:
+                    error = f"Ollama API returned status code {response.status_code}"
+            except httpx.HTTPError as e:
+                error = str(e)
+            if not healthy:
+                logger.warning(f"Ollama server {backend.client.base_url} is unavailable: {error}")
+            with self._lock:
+                backend.healthy, backend.models, backend.error = healthy, models, error
+                backend.checked_at = time.monotonic()
+                backend.checking = False
+                self._checked.notify_all()
+
+        with self._lock:
+            self._checked.wait_for(lambda: not any(b.checking and b.checked_at is None for b in self.backends),
+                                   timeout=self.health_timeout * 2 * len(self.backends))
+
+    def available_models(self, refresh=False):
+        """Names of models installed on any healthy server; raises httpx.ConnectError if none is reachable"""
+        self.check_health(force=refresh)
+        with self._lock:
+            healthy = [b for b in self.backends if b.healthy]
+            if not healthy:
+                errors = "; ".join(f"{b.client.base_url}: {b.error}" for b in self.backends)
+                raise httpx.ConnectError(f"No Ollama server is reachable ({errors})")
+            return sorted(set().union(*(b.models for b in healthy)))
+
+    def pick(self, model_name=None, exclude=()):
+        """Return the healthy server with model_name that has the fewest outstanding requests
+
+        Falls back to any healthy server when none lists the model, and to any server at
+        all when none is known to be healthy, so the caller sees the real connection error.
+        """
+        self.check_health()
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b not in exclude]
+            if model_name:
+                with_model = [b for b in candidates if b.has_model(model_name)]
+                candidates = with_model or candidates
+            if not candidates:
+                candidates = [b for b in self.backends if b not in exclude] or self.backends
+            return min(candidates, key=lambda b: (b.outstanding, b.dispatched))
+
+    @contextmanager
+    def backend(self, model_name=None, exclude=()):
+        """Hold the server picked for one request, counting it as outstanding until the block exits"""
+        backend = self.pick(model_name, exclude)
+        with self._lock:
+            backend.outstanding += 1
+            backend.dispatched += 1
+        try:
+            yield backend
+        finally:
+            with self._lock:
+                backend.outstanding -= 1
+
+    def mark_failed(self, backend, error):
+        """Take a server out of rotation until its next health check"""
+        logger.warning(f"Ollama server {backend.client.base_url} failed: {str(error)}")
+        with self._lock:
+            backend.healthy = False
+            backend.error = str(error)
+            backend.checked_at = time.monotonic()
+
+    def stats(self):
+        """Per-server health, model count and request counts"""
+        with self._lock:
+            return [{
+                "url": b.client.base_url,
+                "healthy": b.healthy,
+                "models": sorted(b.models),
+                "outstanding": b.outstanding,
+                "dispatched": b.dispatched,
+                "error": b.error
+            } for b in self.backends]
+
+def configured_hosts():
+    """Ollama servers from OLLAMA_HOSTS (comma-separated), else OLLAMA_HOST, else the local default"""
+    hosts = os.environ.get("OLLAMA_HOSTS") or os.environ.get("OLLAMA_HOST") or "http://localhost:11434"
+    return [_base_url(host) for host in hosts.split(",") if host.strip()]
+
+_ollama_pool = None
+_ollama_pool_lock = threading.Lock()
+
+def get_ollama_pool():
+    """Return the process-wide pool of Ollama servers"""
+    global _ollama_pool
+    with _ollama_pool_lock:
+        if _ollama_pool is None:
+            _ollama_pool = OllamaPool(
+                configured_hosts(),
+                health_ttl=float(os.environ.get("OLLAMA_HEALTH_TTL", 30)),
+                max_connections=int(os.environ.get("OLLAMA_MAX_CONNECTIONS", 8)),
+                retries=int(os.environ.get("OLLAMA_RETRIES", 3))
+            )
+        return _ollama_pool
+
+def get_ollama_client(model_name=None):
+    """Return the client of the least busy healthy Ollama server (with model_name, when given)"""
+    return get_ollama_pool().pick(model_name).client
@@ -0,0 +1,324 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def fixture_filename(url):
+    """Readable, filesystem-safe fixture name for a URL"""
+    slug = re.sub(r"^[a-z]+://", "", url.strip().lower())
+    slug = re.sub(r"[^a-z0-9]+", "_", slug).strip("_")[:120]
+    digest = hashlib.sha256(url.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}_{digest}.html"
+
+def content_digest(html):
+    """Hash a page body is stored under; also usable as a key for anything derived from the body"""
+    return hashlib.sha256(html.encode("utf-8")).hexdigest()
+
+class PageCache:
+    """Content-addressed on-disk HTML cache keyed by URL with TTLs, revalidation and LRU eviction
+
+    Page bodies are stored once per content hash under objects/, and index.json maps each
+    URL to its body hash, fetch time, last access time and HTTP validators. When a
+    fixture_dir is set the cache runs offline and serves pages only from that directory.
+
+    Several processes (the app and batch runs) may share one cache directory: saving merges
+    the index on disk with this process's changes, and startup only deletes unreferenced
+    bodies older than orphan_grace seconds. Access times of cache hits are saved at most
+    every access_save_interval seconds, and by flush().
+    """
+    def __init__(self, cache_dir, ttl=1800, max_bytes=200 * 1024 * 1024,
+                 stale_while_revalidate=0, fixture_dir=None, orphan_grace=3600, access_save_interval=60):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stale_while_revalidate = stale_while_revalidate
+        self.fixture_dir = fixture_dir
+        self.orphan_grace = orphan_grace
+        self.access_save_interval = access_save_interval
+        self._index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.RLock()
+        self._revalidating = set()
+        self._removed = {}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self._index = self._load_index()
+        self._sweep_orphans()
+
+    def _load_index(self):
+        try:
+            with open(self._index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _merge_index(self):
+        """Fold entries other processes saved into the in-memory index, newest fetch winning"""
+        for url, entry in self._load_index().items():
+            mine = self._index.get(url)
+            if mine is None:
+                # Dropped here since; keep it dropped unless another process fetched it again later
+                if entry["fetched_at"] > self._removed.get(url, float("-inf")):
+                    self._index[url] = entry
+            elif entry["fetched_at"] > mine["fetched_at"]:
+                entry["last_access"] = max(entry["last_access"], mine["last_access"])
+                self._index[url] = entry
+            else:
+                mine["last_access"] = max(entry["last_access"], mine["last_access"])
+
+    def _save_index(self):
+        self._merge_index()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{self._index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+        self._removed.clear()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _remove_entry(self, url):
+        self._removed[url] = time.time()
+        return self._index.pop(url, None)
+
+    def flush(self):
+        """Save access times of cache hits that are not on disk yet"""
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def _object_path(self, digest):
+        return os.path.join(self.cache_dir, "objects", digest[:2], f"{digest}.html")
+
+    def _read_object(self, digest):
+        try:
+            with open(self._object_path(digest), "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _release_object(self, digest):
+        """Delete a body file once no URL in the index refers to it; returns the bytes freed"""
+        if any(entry["digest"] == digest for entry in self._index.values()):
+            return 0
+        path = self._object_path(digest)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return size
+        except OSError:
+            return 0
+
+    def _sweep_orphans(self):
+        """Delete body files the index no longer refers to, e.g. left behind by older versions of the cache
+
+        Files younger than orphan_grace are kept: another process sharing the cache may have
+        just written them and not saved its index yet.
+        """
+        objects_dir = os.path.join(self.cache_dir, "objects")
+        if not os.path.isdir(objects_dir):
+            return
+        referenced = {entry["digest"] for entry in self._index.values()}
+        cutoff = time.time() - self.orphan_grace
+        removed = 0
+        for root, _, files in os.walk(objects_dir):
+            for name in files:
+                # .tmp files may belong to a write in progress in another process
+                if not name.endswith(".html") or name[:-len(".html")] in referenced:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Removed {removed} unreferenced page cache files")
+
+    def _write_object(self, html):
+        data = html.encode("utf-8")
+        digest = content_digest(html)
+        path = self._object_path(digest)
+        if os.path.exists(path):
+            # Referenced again: keep another process's orphan sweep from taking it before our index is saved
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return digest, len(data)
+
+    def _store(self, url, page):
+        size = len(page["html"].encode("utf-8"))
+        if size > self.max_bytes:
+            # Storing it would evict everything else, this page included
+            logger.info(f"Not caching {url}: {size} bytes is more than the cache holds")
+            return
+        with self._lock:
+            digest, size = self._write_object(page["html"])
+            now = time.time()
+            previous = self._index.get(url)
+            self._index[url] = {
+                "digest": digest,
+                "size": size,
+                "fetched_at": now,
+                "last_access": now,
+                "etag": page.get("etag"),
+                "last_modified": page.get("last_modified"),
+                "tier": page.get("tier")
+            }
+            # A changed page points at a new body; the old one goes unless another URL shares it
+            if previous is not None and previous["digest"] != digest:
+                self._release_object(previous["digest"])
+            self._evict()
+            self._save_index()
+
+    def _evict(self):
+        sizes = {}
+        for entry in self._index.values():
+            sizes[entry["digest"]] = entry["size"]
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+
+        for url, entry in sorted(self._index.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            self._remove_entry(url)
+            digest = entry["digest"]
+            if not any(other["digest"] == digest for other in self._index.values()):
+                total -= sizes[digest]
+                self._release_object(digest)
+            logger.info(f"Evicted {url} from page cache")
+
+    def _revalidate(self, url, fetcher, entry):
+        """Fetch url, sending ETag/Last-Modified validators when the entry has them"""
+        page = fetcher(url, etag=entry.get("etag") if entry else None,
+                       last_modified=entry.get("last_modified") if entry else None)
+
+        if page.get("not_modified") and entry:
+            html = self._read_object(entry["digest"])
+            if html is not None:
+                with self._lock:
+                    entry["fetched_at"] = entry["last_access"] = time.time()
+                    self._save_index()
+                logger.info(f"Revalidated {url} (not modified)")
+                return html
+            page = fetcher(url)
+
+        html = page.get("html")
+        if isinstance(html, str) and not html.startswith("ERROR:"):
+            self._store(url, page)
+        return html
+
+    def _revalidate_in_background(self, url, fetcher, entry):
+        with self._lock:
+            if url in self._revalidating:
+                return
+            self._revalidating.add(url)
+
+        def run():
+            try:
+                self._revalidate(url, fetcher, entry)
+            except Exception as e:
+                logger.warning(f"Background revalidation of {url} failed: {str(e)}")
+            finally:
+                with self._lock:
+                    self._revalidating.discard(url)
+
+        threading.Thread(target=run, daemon=True, name="page-cache-revalidate").start()
+
+    def _fixture(self, url):
+        path = os.path.join(self.fixture_dir, fixture_filename(url))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except OSError:
+            return f"ERROR: No offline fixture for {url} (expected {path})"
+
+    def fetch(self, url, fetcher):
+        """Return cached HTML for url, calling fetcher(url, etag=..., last_modified=...) on a miss
+
+        fetcher must return a dict like scrape.fetch_page: html, not_modified, etag, last_modified, tier.
+        """
+        if self.fixture_dir:
+            return self._fixture(url)
+
+        with self._lock:
+            entry = self._index.get(url)
+            html = self._read_object(entry["digest"]) if entry else None
+            if html is not None:
+                entry["last_access"] = time.time()
+                self._dirty = True
+                if time.monotonic() - self._saved_at >= self.access_save_interval:
+                    self._save_index()
+
+        if html is None:
+            return self._revalidate(url, fetcher, None)
+
+        age = time.time() - entry["fetched_at"]
+        if age <= self.ttl:
+            logger.info(f"Page cache hit for {url} (age {age:.0f}s)")
+            return html
+        if age <= self.ttl + self.stale_while_revalidate:
+            logger.info(f"Serving stale {url} (age {age:.0f}s) while revalidating")
+            self._revalidate_in_background(url, fetcher, entry)
+            return html
+        return self._revalidate(url, fetcher, entry)
+
+    def invalidate(self, url=None):
+        """Drop one URL, or every URL when url is None, deleting bodies no other URL shares"""
+        with self._lock:
+            urls = list(self._index) if url is None else [url]
+            removed = [entry for entry in map(self._remove_entry, urls) if entry is not None]
+            for entry in removed:
+                self._release_object(entry["digest"])
+            self._save_index()
+
+    def export_fixtures(self, fixture_dir):
+        """Write every cached page to fixture_dir so later runs can use it offline"""
+        os.makedirs(fixture_dir, exist_ok=True)
+        exported = 0
+        with self._lock:
+            entries = list(self._index.items())
+        for url, entry in entries:
+            html = self._read_object(entry["digest"])
+            if html is None:
+                continue
+            with open(os.path.join(fixture_dir, fixture_filename(url)), "w", encoding="utf-8") as f:
+                f.write(html)
+            exported += 1
+        return exported
+
+_page_cache = None
+_page_cache_lock = threading.Lock()
+
+def get_page_cache():
+    """Return the process-wide page cache, or None when SCRAPER_CACHE=0"""
+    global _page_cache
+    if os.environ.get("SCRAPER_CACHE", "1") == "0":
+        return None
+    with _page_cache_lock:
+        if _page_cache is None:
+            _page_cache = PageCache(
+                cache_dir=os.environ.get("SCRAPER_CACHE_DIR", os.path.join(".scraper_cache", "pages")),
+                ttl=float(os.environ.get("SCRAPER_CACHE_TTL", 1800)),
+                max_bytes=int(float(os.environ.get("SCRAPER_CACHE_MAX_MB", 200)) * 1024 * 1024),
+                stale_while_revalidate=float(os.environ.get("SCRAPER_CACHE_STALE_TTL", 0)),
+                fixture_dir=os.environ.get("SCRAPER_FIXTURE_DIR") or None
+            )
+            atexit.register(_page_cache.flush)
+        return _page_cache
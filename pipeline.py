@@ -0,0 +1,205 @@
+import datetime
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from scrape import process_sources, label_chunks
+from dedup import dedup_chunks
+from relevance import filter_relevant
+from incremental import get_incremental_store
+from analyze import stream_trends_with_ollama, get_chunk_token_budget, get_context_window, is_incomplete_analysis
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Stages of one report run, in order
+STAGES = ["fetch", "coalesced", "extract", "clean", "chunk", "filter", "analyze", "render"]
+
+class StageTimer:
+    """Thread-safe accumulated seconds per pipeline stage
+
+    Per-source stages (fetch, extract, clean, chunk) run on several workers at once, so
+    their totals are summed work time and can exceed the wall time of the scrape.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.seconds[name] = self.seconds.get(name, 0.0) + elapsed
+
+    def add(self, name, seconds):
+        """Add seconds measured elsewhere to a stage"""
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def summary(self):
+        """Return [(stage, seconds)] in pipeline order, including stages not listed in STAGES"""
+        with self._lock:
+            seconds = dict(self.seconds)
+        ordered = [(name, seconds.pop(name)) for name in STAGES if name in seconds]
+        return ordered + sorted(seconds.items())
+
+class ReportPipeline:
+    """One report run driven by the UI: fetch -> extract -> clean -> chunk -> filter -> analyze -> render
+
+    Each stage runs exactly once per run. scrape() and analyze() are generators, so the
+    caller can show progress as sources finish and as the model writes; timings for every
+    stage are kept in self.timer.
+    """
+    def __init__(self, source_urls, source_names, industry, analysis_type, time_period, detail_level,
+                 model="llama3:latest", chunk_size=8000, scrape_workers=4, token_chunking=True,
+                 llm_parallel=None, timeout=180, budget=None, incremental=False, dedup=True,
+                 relevance_filter=True, relevance_budget=0):
+        self.source_urls = list(source_urls)
+        self.source_names = list(source_names)
+        self.industry = industry
+        self.analysis_type = analysis_type
+        self.time_period = time_period
+        self.detail_level = detail_level
+        self.model = model
+        self.chunk_size = chunk_size
+        self.scrape_workers = scrape_workers
+        self.llm_parallel = llm_parallel
+        self.timeout = timeout
+        self.budget = budget
+        self.dedup = dedup
+        self.relevance_filter = relevance_filter
+        self.relevance_budget = relevance_budget
+
+        self.timer = StageTimer()
+        self.chunks = []
+        self.errors = {}
+        self.filter_stats = {}
+        self.result = None
+        self.from_previous_run = False
+
+        # Token budget per chunk when sizing chunks to the model's context window
+        self.num_ctx = None
+        self.max_tokens = None
+        if token_chunking:
+            self.num_ctx = get_context_window(model)
+            self.max_tokens = get_chunk_token_budget(
+                model, industry, analysis_type, time_period, detail_level, num_ctx=self.num_ctx
+            )
+
+        # Incremental mode only passes on paragraphs not seen in earlier runs of this report
+        self.incremental_store = get_incremental_store() if incremental else None
+        self.incremental_scope = None
+        self._new_fingerprints = {}
+        if self.incremental_store is not None:
+            self.incremental_scope = self.incremental_store.scope_key(
+                industry, analysis_type, time_period, detail_level, model
+            )
+
+    def _content_filter(self, url, text):
+        new_text, fingerprints = self.incremental_store.new_content(self.incremental_scope, url, text)
+        self._new_fingerprints[url] = fingerprints
+        return new_text
+
+    def scrape(self):
+        """Fetch, extract, clean and chunk every source concurrently, yielding (index, name, error) as each finishes"""
+        chunks_by_url = {}
+        for i, url, chunks, error in process_sources(
+            self.source_urls,
+            chunk_size=self.chunk_size,
+            max_workers=self.scrape_workers,
+            max_tokens=self.max_tokens,
+            content_filter=self._content_filter if self.incremental_store is not None else None,
+            timer=self.timer
+        ):
+            if error is not None:
+                self.errors[url] = error
+            else:
+                chunks_by_url[url] = chunks
+            yield i, self.source_names[i], error
+
+        # Chunks are kept in source order, whatever order the sources finished in
+        self.chunks = label_chunks(self.source_urls, self.source_names, chunks_by_url)
+
+    def filter(self):
+        """Drop near-duplicate and industry-irrelevant paragraphs; returns the stats of each filter"""
+        with self.timer.stage("filter"):
+            if self.dedup and self.chunks:
+                self.chunks, self.filter_stats["dedup"] = dedup_chunks(self.chunks)
+            if self.relevance_filter and self.chunks:
+                self.chunks, self.filter_stats["relevance"] = filter_relevant(
+                    self.chunks,
+                    self.industry,
+                    max_tokens=self.relevance_budget or None,
+                    pack_tokens=self.max_tokens
+                )
+        return self.filter_stats
+
+    def analyze(self, cancel=None):
+        """Run the LLM analysis, yielding stream_trends_with_ollama events; the final result is kept in self.result
+
+        Setting cancel (a threading.Event) stops the analysis's queued and running LLM calls.
+        """
+        with self.timer.stage("analyze"):
+            store, scope = self.incremental_store, self.incremental_scope
+            last_report = store.last_report(scope) if store is not None else None
+            if last_report and not self.chunks:
+                logger.info("No new content since the last run; reusing the previous report")
+                self.from_previous_run = True
+                self.result = last_report
+                yield {"type": "result", "result": last_report}
+                return
+
+            for event in stream_trends_with_ollama(
+                self.chunks,
+                industry=self.industry,
+                analysis_type=self.analysis_type,
+                time_period=self.time_period,
+                detail_level=self.detail_level,
+                model=self.model,
+                timeout=self.timeout,
+                num_ctx=self.num_ctx,
+                max_parallel=self.llm_parallel,
+                budget=self.budget,
+                prior_analyses=store.prior_analyses(scope) if store is not None else None,
+                cancel=cancel
+            ):
+                if event["type"] == "result":
+                    self.result = event["result"]
+                yield event
+
+            # Remember what was analysed so the next run only pays for new articles
+            if store is not None and "chunk_analyses" in self.result:
+                chunk_analyses = self.result["chunk_analyses"]
+                failed = [a for a in chunk_analyses if is_incomplete_analysis(a)]
+                if not failed:
+                    for url, fingerprints in self._new_fingerprints.items():
+                        store.mark_seen(scope, url, fingerprints)
+                    store.add_analyses(scope, chunk_analyses)
+                    store.save_report(scope, self.result["text"], self.result["visualizations"])
+
+    def render(self):
+        """Return the report as an HTML block for display"""
+        with self.timer.stage("render"):
+            analysis_text = self.result.get("text", "") if isinstance(self.result, dict) else str(self.result)
+            report_date = datetime.datetime.now().strftime("%B %d, %Y")
+            return f"""
+                    <div style="background-color: white; padding: 25px; border-radius: 12px; box-shadow: 0 4px 10px rgba(0, 0, 0, 0.1); margin-top: 20px;">
+                        <div style="border-bottom: 1px solid #e2e8f0; padding-bottom: 15px; margin-bottom: 20px;">
+                            <div style="font-size: 1.5rem; font-weight: 700; color: #1e293b; margin-bottom: 5px;">
+                                {self.industry} Industry Analysis Report
+                            </div>
+                            <div style="font-size: 0.9rem; color: #64748b;">
+                                Generated on {report_date} | Analysis Type: {self.analysis_type} | Time Focus: {self.time_period}
+                            </div>
+                        </div>
+                        <div style="font-size: 1.1rem; line-height: 1.7; color: #334155;">
+                            {analysis_text}
+                        </div>
+                    </div>
+                    """
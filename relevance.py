@@ -0,0 +1,191 @@
+import logging
+import math
+import re
+
+from tokens import count_tokens, truncate_to_tokens
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Terms that signal market news in any industry
+BUSINESS_TERMS = [
+    "startup", "startups", "funding", "raised", "raises", "series a", "series b", "seed round", "investors",
+    "investment", "venture", "valuation", "acquisition", "acquires", "merger", "ipo", "revenue", "growth",
+    "market", "customers", "launch", "launches", "partnership", "regulation", "regulatory", "policy",
+    "competition", "competitors", "expansion", "forecast", "trend", "trends", "billion", "million"
+]
+
+# Per-industry profiles; multi-word terms are matched as phrases
+INDUSTRY_TERMS = {
+    "Healthcare": [
+        "healthcare", "health", "patient", "patients", "hospital", "hospitals", "clinical", "clinician",
+        "physician", "medicare", "medicaid", "payer", "payers", "insurer", "fda", "drug", "biotech",
+        "pharma", "pharmaceutical", "diagnostic", "diagnostics", "telehealth", "telemedicine", "digital health",
+        "medical device", "ehr", "care", "therapy", "trial", "trials", "hipaa", "cms", "provider", "providers"
+    ],
+    "Finance": [
+        "finance", "financial", "fintech", "bank", "banks", "banking", "lending", "loan", "loans", "credit",
+        "payments", "payment", "crypto", "cryptocurrency", "blockchain", "stablecoin", "wealth", "insurance",
+        "insurtech", "trading", "asset", "assets", "sec", "fed", "interest rate", "interest rates",
+        "neobank", "open banking", "compliance", "kyc", "aml", "deposit", "deposits", "card", "cards"
+    ],
+    "Technology": [
+        "technology", "tech", "software", "saas", "cloud", "ai", "artificial intelligence", "machine learning",
+        "llm", "model", "models", "chip", "chips", "semiconductor", "data", "developer", "developers",
+        "open source", "cybersecurity", "security", "platform", "api", "robotics", "quantum", "devices",
+        "app", "apps", "compute", "gpu", "infrastructure", "automation", "enterprise"
+    ],
+    "E-commerce": [
+        "e-commerce", "ecommerce", "retail", "retailer", "retailers", "online", "shopping", "shoppers",
+        "consumer", "consumers", "marketplace", "marketplaces", "checkout", "cart", "merchant", "merchants",
+        "fulfillment", "logistics", "delivery", "shipping", "supply chain", "inventory", "dtc",
+        "direct-to-consumer", "brand", "brands", "amazon", "shopify", "sales", "conversion", "returns"
+    ],
+    "Energy": [
+        "energy", "power", "electricity", "grid", "utility", "utilities", "renewable", "renewables", "solar",
+        "wind", "battery", "batteries", "storage", "hydrogen", "nuclear", "oil", "gas", "lng", "emissions",
+        "carbon", "climate", "decarbonization", "ev", "electric vehicle", "charging", "geothermal",
+        "transmission", "megawatt", "gigawatt", "clean energy", "net zero", "fuel"
+    ]
+}
+
+# Weight of industry terms relative to general business terms
+INDUSTRY_WEIGHT = 2.0
+
+def _term_pattern(terms):
+    alternatives = sorted((re.escape(term) for term in terms), key=len, reverse=True)
+    return re.compile(r"(?<![\w-])(" + "|".join(alternatives) + r")(?![\w-])", re.IGNORECASE)
+
+_BUSINESS_PATTERN = _term_pattern(BUSINESS_TERMS)
+_INDUSTRY_PATTERNS = {industry: _term_pattern(terms) for industry, terms in INDUSTRY_TERMS.items()}
+
+def _matches(paragraph, industry):
+    """Return {term: count} for profile terms in paragraph, industry terms prefixed with "i:" """
+    counts = {}
+    for match in _BUSINESS_PATTERN.findall(paragraph):
+        key = "b:" + match.lower()
+        counts[key] = counts.get(key, 0) + 1
+    pattern = _INDUSTRY_PATTERNS.get(industry)
+    if pattern is not None:
+        for match in pattern.findall(paragraph):
+            key = "i:" + match.lower()
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def score_paragraphs(paragraphs, industry):
+    """TF-IDF style relevance of each paragraph to the industry profile
+
+    Term frequency is damped with log, terms found in most paragraphs (site-wide
+    boilerplate) get a low IDF, and the sum is normalised by the square root of the
+    paragraph length so long paragraphs don't win on size alone.
+    """
+    matches = [_matches(paragraph, industry) for paragraph in paragraphs]
+    document_frequency = {}
+    for counts in matches:
+        for term in counts:
+            document_frequency[term] = document_frequency.get(term, 0) + 1
+
+    n = len(paragraphs)
+    scores = []
+    for paragraph, counts in zip(paragraphs, matches):
+        score = 0.0
+        for term, count in counts.items():
+            idf = math.log((n + 1) / (document_frequency[term] + 0.5))
+            weight = INDUSTRY_WEIGHT if term.startswith("i:") else 1.0
+            score += weight * (1 + math.log(count)) * max(idf, 0.1)
+        words = max(1, len(paragraph.split()))
+        scores.append(score / math.sqrt(words))
+    return scores
+
+def filter_relevant(chunks, industry, max_tokens=None, min_score=0.05, pack_tokens=None):
+    """Keep the most industry-relevant paragraphs of chunks within max_tokens; returns (chunks, stats)
+
+    Chunks may be strings or dicts with a "content" string. Paragraphs (lines) scoring below
+    min_score are dropped, which removes menus, tickers and bylines with no profile terms.
+    When max_tokens is set the highest-scoring paragraphs are kept until the budget is used
+    up; the best paragraph is always kept, truncated to the budget if it alone exceeds it.
+    Kept paragraphs stay in their original order. If nothing scores, the chunks are
+    returned unchanged rather than sending the model nothing.
+
+    Filtered chunks are smaller than they were packed; with pack_tokens, consecutive chunks
+    from the same source are merged up to that many tokens so fewer LLM calls are needed.
+    """
+    paragraphs = []
+    for c, chunk in enumerate(chunks):
+        text = chunk["content"] if isinstance(chunk, dict) else chunk
+        for line in text.split("\n"):
+            if line.strip():
+                paragraphs.append((c, line))
+
+    stats = {"chunks_in": len(chunks), "paragraphs_in": len(paragraphs), "tokens_in": 0, "tokens_out": 0}
+    scores = score_paragraphs([line for _, line in paragraphs], industry)
+    tokens = [count_tokens(line) for _, line in paragraphs]
+    stats["tokens_in"] = sum(tokens)
+
+    candidates = [p for p, score in enumerate(scores) if score >= min_score]
+    if not candidates:
+        logger.warning(f"No paragraphs matched the {industry} profile; keeping all content")
+        stats.update(paragraphs_out=len(paragraphs), tokens_out=stats["tokens_in"], tokens_saved=0)
+        stats["chunks_out"] = len(chunks)
+        return list(chunks), stats
+    candidates.sort(key=lambda p: scores[p], reverse=True)
+
+    kept = set()
+    used = 0
+    for p in candidates:
+        if max_tokens and used + tokens[p] > max_tokens:
+            continue
+        kept.add(p)
+        used += tokens[p]
+    if not kept:
+        # Every relevant paragraph is larger than the budget; an empty report helps nobody
+        best = candidates[0]
+        c, line = paragraphs[best]
+        paragraphs[best] = (c, truncate_to_tokens(line, max_tokens))
+        kept.add(best)
+        used = count_tokens(paragraphs[best][1])
+
+    lines_by_chunk = {}
+    for p, (c, line) in enumerate(paragraphs):
+        if p in kept:
+            lines_by_chunk.setdefault(c, []).append(line)
+
+    filtered = []
+    for c, chunk in enumerate(chunks):
+        if c not in lines_by_chunk:
+            continue
+        text = "\n".join(lines_by_chunk[c])
+        filtered.append(dict(chunk, content=text) if isinstance(chunk, dict) else text)
+
+    if pack_tokens:
+        filtered = _pack(filtered, pack_tokens)
+
+    stats["chunks_out"] = len(filtered)
+    stats["paragraphs_out"] = len(kept)
+    stats["tokens_out"] = used
+    stats["tokens_saved"] = stats["tokens_in"] - used
+    logger.info(f"Relevance filter for {industry} kept {len(kept)} of {len(paragraphs)} paragraphs "
+                f"({used} of {stats['tokens_in']} tokens)")
+    return filtered, stats
+
+def _pack(chunks, pack_tokens):
+    """Merge consecutive chunks from the same source while they fit in pack_tokens
+
+    Only dict chunks say which source they come from; plain strings are never merged.
+    """
+    packed = []
+    packed_tokens = 0
+    for chunk in chunks:
+        text = chunk["content"] if isinstance(chunk, dict) else chunk
+        tokens = count_tokens(text)
+        if packed:
+            previous = packed[-1]
+            same_source = isinstance(chunk, dict) and isinstance(previous, dict) and previous.get("url") == chunk.get("url")
+            if same_source and packed_tokens + tokens <= pack_tokens:
+                packed[-1] = dict(previous, content=previous["content"] + "\n" + text)
+                packed_tokens += tokens
+                continue
+        packed.append(chunk)
+        packed_tokens = tokens
+    return packed
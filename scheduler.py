@@ -0,0 +1,175 @@
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError
+from contextlib import contextmanager
+
+from ollama_client import configured_hosts
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Higher priorities are always served first; batch runs only get slots interactive runs leave free
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BATCH = 0
+
+class SchedulerJob:
+    """One report's share of the LLM scheduler; its calls queue behind each other, not behind other reports"""
+    def __init__(self, scheduler, name, priority=PRIORITY_INTERACTIVE, weight=1.0):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+        self.weight = weight
+        self.last_finish = 0.0
+        self.calls = 0
+        self.wait_seconds = 0.0
+
+    def slot(self, cancel=None, timeout=None):
+        return self.scheduler.slot(self, cancel, timeout)
+
+class _Waiter:
+    def __init__(self, job):
+        self.job = job
+        self.start = 0.0
+        self.granted = False
+        self.cancelled = False
+
+class LLMScheduler:
+    """Priority and weighted-fair queue in front of the LLM server with a global in-flight limit
+
+    Within a priority, waiting calls are ordered by virtual finish time: each call of a job
+    is tagged max(virtual time, the job's previous tag) + 1 / weight. A report that queued
+    40 chunk calls therefore takes turns with a 2-chunk report that arrives later instead
+    of holding the server until all 40 are done. max_in_flight None means no limit.
+    """
+    def __init__(self, max_in_flight=None, wait_samples=1000):
+        self.max_in_flight = max_in_flight
+        self._cond = threading.Condition()
+        self._queue = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._in_flight = 0
+        self._waiting = 0
+        self._dispatched = 0
+        self._waits = deque(maxlen=wait_samples)
+        self._default_job = SchedulerJob(self, "default")
+
+    def job(self, name, priority=PRIORITY_INTERACTIVE, weight=1.0):
+        """Return a handle whose calls are scheduled as one job"""
+        return SchedulerJob(self, name, priority, weight)
+
+    def set_limit(self, limit):
+        """Change the global in-flight limit (None or 0 removes it); returns the previous limit"""
+        with self._cond:
+            previous = self.max_in_flight
+            self.max_in_flight = limit or None
+            self._dispatch()
+        return previous
+
+    def _dispatch(self):
+        """Grant free slots to waiting calls by priority, then by virtual finish time"""
+        while self._queue and (self.max_in_flight is None or self._in_flight < self.max_in_flight):
+            _, _, _, waiter = heapq.heappop(self._queue)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._virtual_time = max(self._virtual_time, waiter.start)
+            self._waiting -= 1
+            self._in_flight += 1
+            self._dispatched += 1
+        self._cond.notify_all()
+
+    def acquire(self, job=None, cancel=None, timeout=None):
+        """Wait for an LLM slot for job; pair with release()
+
+        Raises CancelledError if the cancel event is set, or TimeoutError if timeout seconds
+        pass, before the slot is granted.
+        """
+        job = job or self._default_job
+        enqueued = time.perf_counter()
+        give_up_at = time.monotonic() + timeout if timeout is not None else None
+        with self._cond:
+            waiter = _Waiter(job)
+            waiter.start = max(self._virtual_time, job.last_finish)
+            job.last_finish = waiter.start + 1.0 / job.weight
+            heapq.heappush(self._queue, (-job.priority, job.last_finish, next(self._seq), waiter))
+            self._waiting += 1
+            self._dispatch()
+            while not waiter.granted:
+                cancelled = cancel is not None and cancel.is_set()
+                timed_out = give_up_at is not None and time.monotonic() >= give_up_at
+                if cancelled or timed_out:
+                    waiter.cancelled = True
+                    self._waiting -= 1
+                    # The call never ran; don't charge the job for it in later rounds
+                    job.last_finish -= 1.0 / job.weight
+                    if cancelled:
+                        raise CancelledError("LLM call was cancelled while queued")
+                    raise TimeoutError(f"No LLM slot became free within {timeout:.0f} seconds")
+                # Wake up now and then to notice cancellation
+                wait = 0.5 if cancel is not None else None
+                if give_up_at is not None:
+                    wait = min(wait or float("inf"), max(0.0, give_up_at - time.monotonic()))
+                self._cond.wait(timeout=wait)
+            waited = time.perf_counter() - enqueued
+            self._waits.append(waited)
+            job.calls += 1
+            job.wait_seconds += waited
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, job=None, cancel=None, timeout=None):
+        """Hold one LLM slot for job, queueing until the scheduler grants it (see acquire())"""
+        self.acquire(job, cancel, timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        """Queue depth, in-flight calls and wait times of recent calls"""
+        with self._cond:
+            depth_by_priority = {}
+            for priority, _, _, waiter in self._queue:
+                if not waiter.cancelled:
+                    depth_by_priority[-priority] = depth_by_priority.get(-priority, 0) + 1
+            waits = sorted(self._waits)
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": self._in_flight,
+                "queue_depth": self._waiting,
+                "queue_depth_by_priority": depth_by_priority,
+                "dispatched": self._dispatched,
+                "wait_seconds": {
+                    "mean": sum(waits) / len(waits) if waits else 0.0,
+                    "p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                    "max": waits[-1] if waits else 0.0
+                }
+            }
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_llm_scheduler():
+    """Return the process-wide LLM scheduler
+
+    LLM_MAX_IN_FLIGHT sets the global limit (0 for none); it defaults to OLLAMA_NUM_PARALLEL
+    times the number of servers, the requests they work on at once, so the rest wait here
+    where they can be ordered fairly rather than in a server's first-come queue.
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            default_limit = int(os.environ.get("OLLAMA_NUM_PARALLEL", 1)) * len(configured_hosts())
+            limit = int(os.environ.get("LLM_MAX_IN_FLIGHT", default_limit))
+            _scheduler = LLMScheduler(max_in_flight=limit or None)
+        return _scheduler
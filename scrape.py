@@ -1,16 +1,36 @@
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, Tag
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from page_cache import get_page_cache, content_digest
+from singleflight import SingleFlight
+from tokens import pack_by_tokens
+import requests
+import threading
+import atexit
 import time
 import random
 import logging
+import json
+import os
 import re
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Prefer the much faster lxml parser when it is installed
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
 def get_healthcare_sources():
     return {
         "The Startup Journal": "https://www.thestartupjournal.com/",
@@ -47,99 +67,677 @@ def get_finance_sources():
         "FinTech Magazine": "https://fintechmagazine.com/"
     }
 
-def scrape_website(website):
-    logger.info(f"Connecting to local Chrome WebDriver for {website}...")
-    
+# Industry options with their descriptions and sources
+def get_industry_sources():
+    return {
+        "Healthcare": {
+            "description": "Healthcare technology, medical devices, biotech, and digital health",
+            "sources": get_healthcare_sources()
+        },
+        "Finance": {
+            "description": "Fintech, banking technology, investment platforms, and financial services",
+            "sources": get_finance_sources()
+        },
+        "Technology": {
+            "description": "Software development, cloud computing, AI/ML, and enterprise solutions",
+            "sources": {
+                "TechCrunch": "https://techcrunch.com/",
+                "The Verge": "https://www.theverge.com/",
+                "Wired": "https://www.wired.com/",
+                "VentureBeat": "https://venturebeat.com/",
+                "MIT Technology Review": "https://www.technologyreview.com/"
+            }
+        },
+        "E-commerce": {
+            "description": "Online retail, marketplaces, D2C brands, and retail technology",
+            "sources": {
+                "Retail Dive": "https://www.retaildive.com/",
+                "Digital Commerce 360": "https://www.digitalcommerce360.com/",
+                "Shopify Blog": "https://www.shopify.com/blog",
+                "eMarketer": "https://www.emarketer.com/",
+                "Internet Retailer": "https://www.digitalcommerce360.com/internet-retailer/"
+            }
+        },
+        "Energy": {
+            "description": "Renewable energy, clean tech, energy storage, and sustainability",
+            "sources": {
+                "Greentech Media": "https://www.greentechmedia.com/",
+                "CleanTechnica": "https://cleantechnica.com/",
+                "Energy News Network": "https://energynews.us/",
+                "Renewable Energy World": "https://www.renewableenergyworld.com/",
+                "Bloomberg Green": "https://www.bloomberg.com/green"
+            }
+        }
+    }
+
+def name_sources(source_urls, sources):
+    """Display names for source_urls: their name in sources ({name: url}), else "Custom URL n" by position"""
+    names_by_url = {url: name for name, url in sources.items()}
+    return [names_by_url.get(url, f"Custom URL {i}") for i, url in enumerate(source_urls, start=1)]
+
+def label_chunks(source_urls, source_names, chunks_by_url):
+    """Chunks as the model is given them: {"source", "url", "content"} dicts in source order
+
+    The app and batch runs both build their chunks here, so their LLM response cache
+    entries are shared.
+    """
+    return [
+        {"source": name, "url": url, "content": chunk}
+        for name, url in zip(source_names, source_urls)
+        for chunk in chunks_by_url.get(url) or []
+    ]
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+
+def _chrome_options():
     options = Options()
     options.add_argument("--headless")
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36")
+    options.add_argument(f"user-agent={USER_AGENT}")
     options.add_argument("--disable-notifications")
     options.add_argument("--disable-infobars")
     options.add_argument("--disable-extensions")
+    return options
+
+class DriverPool:
+    """Bounded pool of warm headless Chrome drivers shared between scrapes
+
+    A background reaper shuts down drivers idle for longer than idle_timeout, so an idle
+    app holds no Chrome processes. expanded() raises the size limit for one batch of
+    scrapes and shrinks the pool back to max_size afterwards.
+    """
+    def __init__(self, max_size=3, idle_timeout=300, max_pages=50, page_load_timeout=30):
+        self.base_size = max_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_pages = max_pages
+        self.page_load_timeout = page_load_timeout
+        self._idle = []  # (driver, last_used) pairs, most recently used last
+        self._pages = {}
+        self._size = 0
+        self._expansions = []
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        if idle_timeout:
+            threading.Thread(target=self._reap, name="driver-pool-reaper", daemon=True).start()
+
+    def _reap(self):
+        interval = max(1.0, min(self.idle_timeout / 2, 60.0))
+        while not self._stop.wait(interval):
+            try:
+                self.evict_idle()
+            except Exception as e:
+                logger.warning(f"Error evicting idle Chrome WebDrivers: {str(e)}")
+
+    def _create_driver(self):
+        driver = webdriver.Chrome(options=_chrome_options())
+        driver.set_page_load_timeout(self.page_load_timeout)
+        driver.set_window_size(1920, 1080)
+        self._pages[id(driver)] = 0
+        return driver
+
+    def _destroy_driver(self, driver):
+        self._pages.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Error shutting down Chrome WebDriver: {str(e)}")
+
+    def _is_healthy(self, driver):
+        try:
+            return driver.execute_script("return 1") == 1
+        except Exception:
+            return False
+
+    def _evict_idle_locked(self):
+        now = time.monotonic()
+        expired = [entry for entry in self._idle if now - entry[1] > self.idle_timeout]
+        if expired:
+            self._idle = [entry for entry in self._idle if now - entry[1] <= self.idle_timeout]
+            self._size -= len(expired)
+            self._cond.notify_all()
+        return [driver for driver, _ in expired]
+
+    def evict_idle(self):
+        """Shut down drivers that have been idle for longer than idle_timeout"""
+        with self._cond:
+            expired = self._evict_idle_locked()
+        for driver in expired:
+            self._destroy_driver(driver)
+        if expired:
+            logger.info(f"Evicted {len(expired)} idle Chrome WebDriver(s)")
+        return len(expired)
+
+    def acquire(self, timeout=None):
+        """Lease a healthy driver, starting a new one if the pool has room"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.evict_idle()
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("Driver pool is closed")
+                    if self._idle:
+                        driver, _ = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        driver = None
+                        break
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError("Timed out waiting for a free Chrome WebDriver")
+                    self._cond.wait(remaining)
+
+            if driver is None:
+                try:
+                    return self._create_driver()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+
+            if self._is_healthy(driver):
+                return driver
+
+            logger.warning("Discarding unhealthy Chrome WebDriver from pool")
+            self._destroy_driver(driver)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+
+    def release(self, driver, broken=False):
+        """Return a leased driver; broken or worn-out drivers are recycled"""
+        pages = self._pages.get(id(driver), 0) + 1
+        self._pages[id(driver)] = pages
+        recycle = broken or self._closed or pages >= self.max_pages or self._size > self.max_size
+
+        if not recycle:
+            try:
+                driver.delete_all_cookies()
+                driver.get("about:blank")
+            except Exception:
+                recycle = True
+
+        if recycle:
+            if not broken and pages >= self.max_pages:
+                logger.info(f"Recycling Chrome WebDriver after {pages} pages")
+            self._destroy_driver(driver)
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._idle.append((driver, time.monotonic()))
+            self._cond.notify()
+
+    def _trim_locked(self):
+        """Take idle drivers above max_size out of the pool, oldest first; returns them for shutdown"""
+        excess = min(len(self._idle), self._size - self.max_size)
+        if excess <= 0:
+            return []
+        trimmed = [driver for driver, _ in self._idle[:excess]]
+        self._idle = self._idle[excess:]
+        self._size -= excess
+        return trimmed
+
+    def _apply_size(self):
+        with self._cond:
+            self.max_size = max([self.base_size] + self._expansions)
+            trimmed = self._trim_locked()
+            self._cond.notify_all()
+        for driver in trimmed:
+            self._destroy_driver(driver)
+
+    def resize(self, max_size):
+        """Change the number of drivers the pool may keep alive at once"""
+        self.base_size = max_size
+        self._apply_size()
+
+    @contextmanager
+    def expanded(self, max_size):
+        """Allow up to max_size drivers while the block runs, then shrink back"""
+        with self._cond:
+            self._expansions.append(max_size)
+        self._apply_size()
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._expansions.remove(max_size)
+            self._apply_size()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        driver = self.acquire(timeout=timeout)
+        broken = False
+        try:
+            yield driver
+        except Exception:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    def close(self):
+        """Shut down every idle driver and refuse new leases"""
+        self._stop.set()
+        with self._cond:
+            self._closed = True
+            idle = [driver for driver, _ in self._idle]
+            self._size -= len(idle)
+            self._idle = []
+            self._cond.notify_all()
+        for driver in idle:
+            self._destroy_driver(driver)
+
+_driver_pool = None
+_driver_pool_lock = threading.Lock()
+
+def get_driver_pool():
+    """Return the process-wide driver pool, creating it on first use"""
+    global _driver_pool
+    with _driver_pool_lock:
+        if _driver_pool is None or _driver_pool._closed:
+            _driver_pool = DriverPool(
+                max_size=int(os.environ.get("SCRAPER_POOL_SIZE", 3)),
+                idle_timeout=float(os.environ.get("SCRAPER_POOL_IDLE_TIMEOUT", 300)),
+                max_pages=int(os.environ.get("SCRAPER_POOL_MAX_PAGES", 50))
+            )
+            atexit.register(_driver_pool.close)
+        return _driver_pool
+
+# Milliseconds since the last DOM mutation; installs the observer on first call.
+# Attribute changes are ignored: carousels, tickers and rotating ads toggle classes and
+# styles forever, which would keep the page from ever looking settled.
+_DOM_QUIET_JS = """
+if (!window.__scrapeObserver) {
+    window.__lastMutation = Date.now();
+    window.__scrapeObserver = new MutationObserver(function() { window.__lastMutation = Date.now(); });
+    window.__scrapeObserver.observe(document, {childList: true, subtree: true, characterData: true});
+}
+return Date.now() - window.__lastMutation;
+"""
+
+_wait_stats = {}
+_wait_stats_lock = threading.Lock()
+
+def get_wait_stats():
+    """Return the seconds spent waiting for each scraped URL (latest scrape per URL)"""
+    with _wait_stats_lock:
+        return dict(_wait_stats)
+
+def _record_wait(website, seconds, wait_mode):
+    with _wait_stats_lock:
+        _wait_stats[website] = seconds
+    logger.info(f"Waited {seconds:.2f}s for {website} to settle ({wait_mode} wait)")
+
+def _wait_until(predicate, deadline, poll_interval=0.1):
+    while True:
+        try:
+            if predicate():
+                return True
+        except Exception:
+            pass
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(min(poll_interval, max(deadline - time.monotonic(), 0)))
+
+def _dismiss_cookie_banner(driver):
+    try:
+        cookie_buttons = driver.find_elements(By.XPATH, "//button[contains(text(), 'Accept') or contains(text(), 'I agree') or contains(text(), 'Continue')]")
+        if cookie_buttons:
+            cookie_buttons[0].click()
+            return True
+    except Exception as e:
+        logger.warning(f"Error handling cookie banner: {e}")
+    return False
+
+def _fixed_wait(driver):
+    """Original fixed-delay wait: 3s load, three 1s scroll steps, 1s after a cookie click"""
+    time.sleep(3)
+    
+    total_height = driver.execute_script("return document.body.scrollHeight")
+    for i in range(3):
+        driver.execute_script(f"window.scrollTo(0, {total_height * (i+1) / 4});")
+        time.sleep(1)
+    driver.execute_script("window.scrollTo(0, 0);")
+    
+    if _dismiss_cookie_banner(driver):
+        time.sleep(1)
+
+def _adaptive_wait(driver, max_wait=6, quiet_period=0.5, poll_interval=0.1):
+    """Wait for document readiness, DOM quiescence and a stable scroll height, capped at max_wait"""
+    deadline = time.monotonic() + max_wait
+    
+    def dom_is_quiet(period=quiet_period):
+        return driver.execute_script(_DOM_QUIET_JS) >= period * 1000
+    
+    _wait_until(lambda: driver.execute_script("return document.readyState") == "complete", deadline, poll_interval)
+    _wait_until(dom_is_quiet, deadline, poll_interval)
+    
+    total_height = driver.execute_script("return document.body.scrollHeight")
+    for i in range(3):
+        driver.execute_script(f"window.scrollTo(0, {total_height * (i+1) / 4});")
+        heights = [None]
+        
+        def height_is_stable():
+            height = driver.execute_script("return document.body.scrollHeight")
+            stable = height == heights[0]
+            heights[0] = height
+            return stable and dom_is_quiet(quiet_period / 2)
+        
+        _wait_until(height_is_stable, deadline, poll_interval)
+    driver.execute_script("window.scrollTo(0, 0);")
+    
+    if _dismiss_cookie_banner(driver):
+        _wait_until(dom_is_quiet, deadline, poll_interval)
+
+def scrape_website(website, pool=None, wait_mode=None, max_wait=None):
+    logger.info(f"Leasing Chrome WebDriver for {website}...")
+    pool = pool or get_driver_pool()
+    wait_mode = wait_mode or os.environ.get("SCRAPER_WAIT_MODE", "adaptive")
+    if max_wait is None:
+        # Never longer than the old fixed wait of about six seconds
+        max_wait = float(os.environ.get("SCRAPER_MAX_WAIT", 6))
     
     try:
-        driver = webdriver.Chrome(options=options)
-        driver.set_page_load_timeout(30)
+        driver = pool.acquire()
     except Exception as e:
         logger.error(f"Failed to initialize Chrome WebDriver: {str(e)}")
         return f"ERROR: Failed to initialize Chrome WebDriver: {str(e)}"
     
+    broken = False
     try:
-        driver.set_window_size(1920, 1080)
         driver.get(website)
         logger.info(f"Navigated to {website}! Waiting for dynamic content to load...")
-        time.sleep(3)
         
-        total_height = driver.execute_script("return document.body.scrollHeight")
-        for i in range(3):
-            driver.execute_script(f"window.scrollTo(0, {total_height * (i+1) / 4});")
-            time.sleep(1)
-        driver.execute_script("window.scrollTo(0, 0);")
-        
-        try:
-            cookie_buttons = driver.find_elements(By.XPATH, "//button[contains(text(), 'Accept') or contains(text(), 'I agree') or contains(text(), 'Continue')]")
-            if cookie_buttons:
-                cookie_buttons[0].click()
-                time.sleep(1)
-        except Exception as e:
-            logger.warning(f"Error handling cookie banner: {e}")
+        wait_start = time.monotonic()
+        if wait_mode == "fixed":
+            _fixed_wait(driver)
+        else:
+            _adaptive_wait(driver, max_wait=max_wait)
+        _record_wait(website, time.monotonic() - wait_start, wait_mode)
         
         logger.info("Scraping page content...")
         html = driver.page_source
         return html
     except Exception as e:
+        broken = True
         logger.error(f"Error scraping {website}: {str(e)}")
         return f"ERROR: Error scraping {website}: {str(e)}"
     finally:
-        driver.quit()
+        pool.release(driver, broken=broken)
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+def get_http_session():
+    """Return the shared keep-alive HTTP session used for static page fetches"""
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16, max_retries=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "User-Agent": USER_AGENT,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "en-US,en;q=0.9"
+            })
+            _http_session = session
+        return _http_session
+
+def _static_response(website, timeout=15, headers=None):
+    """Return (response, error) for a plain HTTP GET; 304 responses are passed through
+
+    On error the response is still returned when there is one, so callers can tell a 4xx
+    from a failed connection.
+    """
+    try:
+        response = get_http_session().get(website, timeout=timeout, headers=headers)
+    except requests.exceptions.RequestException as e:
+        return None, f"ERROR: Error fetching {website}: {str(e)}"
+    if response.status_code == 304:
+        return response, None
+    if response.status_code != 200:
+        return response, f"ERROR: HTTP {response.status_code} fetching {website}"
+    content_type = response.headers.get("Content-Type", "")
+    if "html" not in content_type and "xml" not in content_type:
+        return None, f"ERROR: Unexpected content type {content_type!r} from {website}"
+    return response, None
+
+class FetchTierStore:
+    """Remembers per URL whether plain HTTP is enough or a browser is required
+
+    Pages are keyed by host and path, so a JS-only section does not send the static pages
+    on the same site to Chrome. A "browser" decision expires after browser_ttl seconds and
+    the page is probed over HTTP again, e.g. once a consent or anti-bot page goes away.
+    """
+    def __init__(self, path=None, browser_ttl=None):
+        self.path = path or os.environ.get("SCRAPER_TIER_FILE", os.path.join(".scraper_cache", "fetch_tiers.json"))
+        self.browser_ttl = browser_ttl if browser_ttl is not None else float(os.environ.get("SCRAPER_TIER_TTL", 86400))
+        self._lock = threading.Lock()
+        self._tiers = None
+
+    @staticmethod
+    def key(website):
+        parsed = urlparse(website)
+        return f"{parsed.netloc.lower()}{parsed.path or '/'}"
+
+    def _load(self):
+        if self._tiers is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    tiers = json.load(f)
+            except (OSError, ValueError):
+                tiers = {}
+            # Older files stored a bare tier per domain; those keys no longer match any URL
+            self._tiers = {key: entry for key, entry in tiers.items() if isinstance(entry, dict)}
+        return self._tiers
+
+    def get(self, website):
+        with self._lock:
+            entry = self._load().get(self.key(website))
+        if entry is None:
+            return None
+        if entry["tier"] == "browser" and time.time() - entry["checked_at"] >= self.browser_ttl:
+            return None
+        return entry["tier"]
+
+    def set(self, website, tier):
+        key = self.key(website)
+        with self._lock:
+            tiers = self._load()
+            previous = tiers.get(key)
+            # Re-saving "http" on every fetch would only rewrite the file; it never expires
+            if tier == "http" and previous is not None and previous["tier"] == tier:
+                return
+            tiers[key] = {"tier": tier, "checked_at": time.time()}
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(tiers, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not save fetch tier for {website}: {str(e)}")
+
+_tier_store = FetchTierStore()
+
+def fetch_page(website, tier_store=None, etag=None, last_modified=None):
+    """Tiered fetch returning a dict with the HTML, the tier used and HTTP cache validators"""
+    tier_store = tier_store or _tier_store
+    page = {"html": None, "tier": "browser", "not_modified": False, "etag": None, "last_modified": None}
+    
+    if tier_store.get(website) != "browser":
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response, error = _static_response(website, headers=headers)
+        
+        if response is not None and response.status_code == 304:
+            page.update(tier="http", not_modified=True, etag=etag, last_modified=last_modified)
+            return page
+        
+        if error and response is not None and 400 <= response.status_code < 500:
+            # A missing or forbidden page is not going to render in Chrome either
+            page.update(html=error, tier="http")
+            return page
+        
+        if error:
+            # Timeouts, 5xx and odd content types say nothing about the page needing JS; don't remember them
+            logger.info(f"HTTP probe of {website} failed ({error}); using Chrome for this fetch only")
+            page["html"] = scrape_website(website)
+            return page
+        
+        html = response.text
+        js_needed, content = _probe_content(html)
+        if not js_needed:
+            logger.info(f"Fetched {website} over plain HTTP")
+            tier_store.set(website, "http")
+            # The probe already parsed the page; its extracted text saves extraction a second parse
+            page.update(
+                html=html,
+                content=content,
+                tier="http",
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified")
+            )
+            return page
+        
+        logger.info(f"{website} needs JS rendering; escalating to Chrome")
+        tier_store.set(website, "browser")
+    
+    page["html"] = scrape_website(website)
+    return page
+
+# Tags that never carry article text; dropped while walking the parsed tree
+BOILERPLATE_TAGS = frozenset(['script', 'style', 'nav', 'footer', 'header', 'aside', 'meta', 'form', 'iframe', 'noscript'])
+
+# Content selectors in priority order: (tag, attribute, accepted values)
+CONTENT_SELECTORS = [
+    ('article', None, None),
+    ('div', 'class', frozenset(['post', 'article', 'entry', 'content', 'news-item'])),
+    ('div', 'id', frozenset(['content', 'main-content', 'article-content', 'post-content'])),
+    ('main', None, None),
+    ('section', 'class', frozenset(['content', 'main', 'articles', 'news'])),
+    ('h2', None, None),
+    ('h3', None, None)
+]
+
+_SELECTORS_BY_TAG = {}
+for _i, _selector in enumerate(CONTENT_SELECTORS):
+    _SELECTORS_BY_TAG.setdefault(_selector[0], []).append((_i, _selector))
+
+def _selector_matches(tag, selector):
+    _, attribute, values = selector
+    if attribute is None:
+        return True
+    value = tag.get(attribute)
+    if value is None:
+        return False
+    if isinstance(value, str):
+        value = [value]
+    return any(v in values for v in value)
+
+def parse_html(html_content):
+    """Parse a document once, dropping boilerplate tags and bucketing content selector matches
+
+    Returns (soup, buckets) where buckets[i] holds the elements matching CONTENT_SELECTORS[i]
+    in document order. Uses lxml when it is installed.
+    """
+    soup = BeautifulSoup(html_content, HTML_PARSER)
+    buckets = [[] for _ in CONTENT_SELECTORS]
+    boilerplate = []
+    stack = [soup]
+    
+    while stack:
+        node = stack.pop()
+        children = [child for child in node.contents if isinstance(child, Tag)]
+        for child in reversed(children):
+            if child.name in BOILERPLATE_TAGS:
+                boilerplate.append(child)
+            else:
+                stack.append(child)
+        if node is soup:
+            continue
+        for i, selector in _SELECTORS_BY_TAG.get(node.name, ()):
+            if _selector_matches(node, selector):
+                buckets[i].append(node)
+    
+    for element in boilerplate:
+        element.extract()
+    return soup, buckets
+
+def _select_content(buckets):
+    """Return text of the first content selector that yields more than 500 characters"""
+    for elements in buckets:
+        if elements:
+            content = "\n\n".join([element.get_text(separator="\n") for element in elements])
+            if content and len(content) > 500:
+                return content
+    return None
+
+def _content_from_parsed(soup, buckets):
+    """Article text from a parse_html result: the first good content selector, else the whole body"""
+    content = _select_content(buckets)
+    if content:
+        return content
+    
+    body_content = soup.body
+    if body_content:
+        return body_content.get_text(separator="\n")
+    
+    return "No content found on the page."
 
 def extract_body_content(html_content):
     if isinstance(html_content, str) and html_content.startswith("ERROR:"):
         return html_content
     
     try:
-        soup = BeautifulSoup(html_content, "html.parser")
-        content_elements = [
-            soup.find_all('article'),
-            soup.find_all('div', {'class': ['post', 'article', 'entry', 'content', 'news-item']}),
-            soup.find_all('div', {'id': ['content', 'main-content', 'article-content', 'post-content']}),
-            soup.find_all('main'),
-            soup.find_all('section', {'class': ['content', 'main', 'articles', 'news']}),
-            soup.find_all('h2'),
-            soup.find_all('h3')
-        ]
-        
-        for elements in content_elements:
-            if elements:
-                content = "\n\n".join([element.get_text(separator="\n") for element in elements])
-                if content and len(content) > 500:
-                    return content
-        
-        body_content = soup.body
-        if body_content:
-            return body_content.get_text(separator="\n")
-        
-        return "No content found on the page."
+        return _content_from_parsed(*parse_html(html_content))
     except Exception as e:
         logger.error(f"Error extracting content: {str(e)}")
         return f"ERROR: Error extracting content: {str(e)}"
 
+def _probe_content(html_content, min_body_text=1000):
+    """Parse a static page once; returns (needs JS rendering, extract_body_content result)"""
+    soup, buckets = parse_html(html_content)
+    content = _select_content(buckets)
+    if content:
+        return False, content
+    
+    body_text = soup.body.get_text(" ", strip=True) if soup.body else ""
+    return len(body_text) < min_body_text, _content_from_parsed(soup, buckets)
+
+# Matches text that still contains markup, e.g. raw HTML passed straight to clean_body_content
+_MARKUP_RE = re.compile(r"<[A-Za-z!/]")
+
 def clean_body_content(body_content):
     if isinstance(body_content, str) and body_content.startswith("ERROR:"):
         return body_content
     
     try:
-        if isinstance(body_content, str):
-            soup = BeautifulSoup(f"<div>{body_content}</div>", "html.parser")
+        if isinstance(body_content, str) and not _MARKUP_RE.search(body_content):
+            # Already plain text from extract_body_content; no need to parse it again
+            content = body_content
         else:
-            soup = body_content
-        
-        for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'meta', 'form', 'iframe', 'noscript']):
-            element.extract()
+            if isinstance(body_content, str):
+                soup, _ = parse_html(f"<div>{body_content}</div>")
+            else:
+                soup = body_content
+                for element in soup(list(BOILERPLATE_TAGS)):
+                    element.extract()
+            content = soup.get_text(separator="\n")
         
-        content = soup.get_text(separator="\n") if isinstance(body_content, str) else soup
         lines = [line.strip() for line in content.splitlines() if line.strip()]
         cleaned_content = "\n".join(lines)
         cleaned_content = re.sub(r'\n{3,}', '\n\n', cleaned_content)
@@ -150,7 +748,80 @@ def clean_body_content(body_content):
         logger.error(f"Error cleaning content: {str(e)}")
         return f"ERROR: Error cleaning content: {str(e)}"
 
-def split_dom_content(dom_content, max_length=8000, chunk_size=None):
+def _iter_sentence_chunks(text, start, end, max_length):
+    """Sentence-level packing of text[start:end], joining sentences on ". " like the paragraph packer"""
+    chunk_start = chunk_end = start
+    pos = start
+    while True:
+        split_at = text.find(". ", pos, end)
+        sentence_end = end if split_at == -1 else split_at
+        sentence_len = sentence_end - pos
+        chunk_len = chunk_end - chunk_start
+        
+        if chunk_len + sentence_len + 2 <= max_length:
+            if chunk_len:
+                chunk_end = sentence_end
+            else:
+                chunk_start, chunk_end = pos, sentence_end
+        else:
+            if chunk_len:
+                yield text[chunk_start:chunk_end] + "."
+            if sentence_len > max_length:
+                for i in range(pos, sentence_end, max_length):
+                    yield text[i:min(i + max_length, sentence_end)]
+                chunk_start = chunk_end = sentence_end
+            else:
+                chunk_start, chunk_end = pos, sentence_end
+        
+        if split_at == -1:
+            break
+        pos = split_at + 2
+    
+    if chunk_end > chunk_start:
+        yield text[chunk_start:chunk_end]
+
+def iter_dom_chunks(dom_content, max_length=8000):
+    """Lazily yield chunks of at most max_length characters, splitting on paragraphs, then sentences, then hard cuts
+
+    Chunks are sliced straight from dom_content by offset, so the whole pass is linear in the input size.
+    """
+    if len(dom_content) <= max_length:
+        yield dom_content
+        return
+    
+    # The current chunk is always the contiguous slice dom_content[chunk_start:chunk_end]
+    chunk_start = chunk_end = 0
+    pos = 0
+    end = len(dom_content)
+    while True:
+        split_at = dom_content.find("\n\n", pos)
+        paragraph_end = end if split_at == -1 else split_at
+        paragraph_len = paragraph_end - pos
+        chunk_len = chunk_end - chunk_start
+        
+        if chunk_len + paragraph_len + 2 <= max_length:
+            if chunk_len:
+                chunk_end = paragraph_end
+            else:
+                chunk_start, chunk_end = pos, paragraph_end
+        else:
+            if chunk_len:
+                yield dom_content[chunk_start:chunk_end]
+            if paragraph_len > max_length:
+                yield from _iter_sentence_chunks(dom_content, pos, paragraph_end, max_length)
+                chunk_start = chunk_end = paragraph_end
+            else:
+                chunk_start, chunk_end = pos, paragraph_end
+        
+        if split_at == -1:
+            break
+        pos = split_at + 2
+    
+    if chunk_end > chunk_start:
+        yield dom_content[chunk_start:chunk_end]
+
+def split_dom_content(dom_content, max_length=8000, chunk_size=None, max_tokens=None):
+    """Split text into chunks of max_length characters, or of max_tokens tokens when a token budget is given"""
     if chunk_size is not None:
         max_length = chunk_size
     
@@ -158,54 +829,169 @@ def split_dom_content(dom_content, max_length=8000, chunk_size=None):
         return [dom_content]
     
     try:
-        if len(dom_content) <= max_length:
-            return [dom_content]
-        
-        chunks = []
-        paragraphs = dom_content.split("\n\n")
-        current_chunk = ""
-        
-        for paragraph in paragraphs:
-            if not isinstance(paragraph, str):
-                logger.warning(f"Skipping non-string paragraph: {type(paragraph)}")
-                continue
-            
-            if len(current_chunk) + len(paragraph) + 2 <= max_length:
-                if current_chunk:
-                    current_chunk += "\n\n"
-                current_chunk += paragraph
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk)
-                if len(paragraph) > max_length:
-                    sentences = paragraph.split(". ")
-                    current_chunk = ""
-                    for sentence in sentences:
-                        if not isinstance(sentence, str):
-                            logger.warning(f"Skipping non-string sentence: {type(sentence)}")
-                            continue
-                        if len(current_chunk) + len(sentence) + 2 <= max_length:
-                            if current_chunk:
-                                current_chunk += ". "
-                            current_chunk += sentence
-                        else:
-                            if current_chunk:
-                                chunks.append(current_chunk + ".")
-                            if len(sentence) > max_length:
-                                for i in range(0, len(sentence), max_length):
-                                    chunks.append(sentence[i:i+max_length])
-                                current_chunk = ""
-                            else:
-                                current_chunk = sentence
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = ""
-                else:
-                    current_chunk = paragraph
-        if current_chunk:
-            chunks.append(current_chunk)
-        
-        return chunks
+        if max_tokens is not None:
+            return pack_by_tokens(dom_content, max_tokens, iter_dom_chunks)
+        return list(iter_dom_chunks(dom_content, max_length))
     except Exception as e:
         logger.error(f"Error splitting content: {str(e)}")
-        return [f"ERROR: Error splitting content: {str(e)}"]
\ No newline at end of file
+        return [f"ERROR: Error splitting content: {str(e)}"]
+
+class DomainThrottle:
+    """Per-domain politeness limits: bounded concurrency plus a minimum delay between requests"""
+    def __init__(self, max_per_domain=1, min_interval=1.0):
+        self.max_per_domain = max_per_domain
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._last_request = {}
+
+    def _domain_state(self, domain):
+        with self._lock:
+            if domain not in self._semaphores:
+                self._semaphores[domain] = threading.Semaphore(self.max_per_domain)
+                self._last_request[domain] = 0.0
+            return self._semaphores[domain]
+
+    @contextmanager
+    def slot(self, url):
+        domain = urlparse(url).netloc.lower()
+        semaphore = self._domain_state(domain)
+        with semaphore:
+            with self._lock:
+                wait = self._last_request[domain] + self.min_interval - time.monotonic()
+                self._last_request[domain] = time.monotonic() + max(wait, 0)
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+_source_flights = SingleFlight()
+
+class _PageMemo:
+    """Small thread-safe LRU map for results derived from page bodies, keyed on their page-cache digest
+
+    Keying on the digest instead of the body keeps only the results alive, not the pages.
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+# Cleaned text and chunks of unchanged pages, so a page is only processed once
+_cleaned_pages = _PageMemo(32)
+_page_chunks = _PageMemo(128)
+
+def _stage(timer, name):
+    """timer.stage(name) when a stage timer is given, otherwise a no-op context"""
+    return timer.stage(name) if timer is not None else nullcontext()
+
+def process_source(url, chunk_size=8000, throttle=None, cache=None, max_tokens=None, content_filter=None, timer=None):
+    """Fetch (through the page cache), extract, clean and chunk a single source URL
+
+    content_filter(url, cleaned_text) may return a reduced text to chunk, e.g. only new paragraphs.
+    timer, if given, records the fetch, extract, clean and chunk stages (see pipeline.StageTimer);
+    a call that joined another caller's in-flight fetch records its wait as "coalesced" instead.
+    """
+    fetched = {}
+    
+    def fetcher(website, etag=None, last_modified=None):
+        if throttle is None:
+            page = fetch_page(website, etag=etag, last_modified=last_modified)
+        else:
+            with throttle.slot(website):
+                page = fetch_page(website, etag=etag, last_modified=last_modified)
+        fetched["page"] = page
+        return page
+    
+    cache = cache if cache is not None else get_page_cache()
+    
+    def fetch_and_clean():
+        fetched["leader"] = True
+        with _stage(timer, "fetch"):
+            if cache is not None:
+                html_content = cache.fetch(url, fetcher)
+            else:
+                html_content = fetcher(url)["html"]
+        
+        digest = content_digest(html_content) if isinstance(html_content, str) and not html_content.startswith("ERROR:") else None
+        cleaned = _cleaned_pages.get(digest) if digest is not None else None
+        if cleaned is not None:
+            return digest, cleaned
+        
+        with _stage(timer, "extract"):
+            # A page fetched over HTTP just now was parsed by the tier probe; reuse its text
+            page = fetched.get("page")
+            if page is not None and page.get("content") is not None and page.get("html") is html_content:
+                body_content = page["content"]
+            else:
+                body_content = extract_body_content(html_content)
+        with _stage(timer, "clean"):
+            cleaned = clean_body_content(body_content)
+        if digest is not None and not cleaned.startswith("ERROR:"):
+            _cleaned_pages.put(digest, cleaned)
+        return digest, cleaned
+    
+    # Concurrent requests for the same URL through the same page cache (other industries, sessions or
+    # batch jobs) share one fetch
+    started = time.perf_counter()
+    digest, cleaned_content = _source_flights.do((url, id(cache)), fetch_and_clean)
+    if timer is not None and not fetched.get("leader"):
+        timer.add("coalesced", time.perf_counter() - started)
+    
+    with _stage(timer, "chunk"):
+        if content_filter is not None:
+            cleaned_content = content_filter(url, cleaned_content)
+            if not cleaned_content:
+                return []
+            return split_dom_content(cleaned_content, chunk_size=chunk_size, max_tokens=max_tokens)
+        if digest is None:
+            return split_dom_content(cleaned_content, chunk_size=chunk_size, max_tokens=max_tokens)
+        key = (digest, chunk_size, max_tokens)
+        chunks = _page_chunks.get(key)
+        if chunks is None:
+            chunks = tuple(split_dom_content(cleaned_content, chunk_size=chunk_size, max_tokens=max_tokens))
+            _page_chunks.put(key, chunks)
+        return list(chunks)
+
+def process_sources(source_urls, chunk_size=8000, max_workers=3, max_per_domain=1, min_domain_interval=1.0, max_tokens=None, content_filter=None, timer=None):
+    """Process sources concurrently, yielding (index, url, chunks, error) as each one finishes"""
+    if not source_urls:
+        return
+    
+    max_workers = max(1, min(max_workers, len(source_urls)))
+    throttle = DomainThrottle(max_per_domain=max_per_domain, min_interval=min_domain_interval)
+    
+    # A URL listed more than once is processed once and reported at each of its positions
+    positions = {}
+    for i, url in enumerate(source_urls):
+        positions.setdefault(url, []).append(i)
+    
+    # Browser-tier sources may use one driver per worker; the pool shrinks back once they are done
+    with get_driver_pool().expanded(max_workers), \
+            ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="scrape") as executor:
+        futures = {
+            executor.submit(process_source, url, chunk_size, throttle, max_tokens=max_tokens, content_filter=content_filter, timer=timer): url
+            for url in positions
+        }
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                chunks, error = future.result(), None
+            except Exception as e:
+                logger.error(f"Error processing {url}: {str(e)}")
+                chunks, error = [], e
+            for i in positions[url]:
+                yield i, url, list(chunks), error
\ No newline at end of file
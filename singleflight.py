@@ -0,0 +1,52 @@
+import logging
+import threading
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one call whose result every caller gets
+
+    Only calls that overlap in time are shared; once a call finishes the next do() for
+    that key runs func again. Exceptions are re-raised in every waiting caller.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            logger.info(f"Joining in-flight call for {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def in_flight(self):
+        """Number of keys with a call currently running"""
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,73 @@
+"""split_dom_content must chunk exactly like the implementation it replaced"""
+import random
+
+import pytest
+
+from scrape import split_dom_content
+
+def legacy_split_dom_content(dom_content, max_length=8000):
+    """split_dom_content as it was before the offset-based chunker"""
+    if len(dom_content) <= max_length:
+        return [dom_content]
+
+    chunks = []
+    paragraphs = dom_content.split("\n\n")
+    current_chunk = ""
+
+    for paragraph in paragraphs:
+        if len(current_chunk) + len(paragraph) + 2 <= max_length:
+            if current_chunk:
+                current_chunk += "\n\n"
+            current_chunk += paragraph
+        else:
+            if current_chunk:
+                chunks.append(current_chunk)
+            if len(paragraph) > max_length:
+                sentences = paragraph.split(". ")
+                current_chunk = ""
+                for sentence in sentences:
+                    if len(current_chunk) + len(sentence) + 2 <= max_length:
+                        if current_chunk:
+                            current_chunk += ". "
+                        current_chunk += sentence
+                    else:
+                        if current_chunk:
+                            chunks.append(current_chunk + ".")
+                        if len(sentence) > max_length:
+                            for i in range(0, len(sentence), max_length):
+                                chunks.append(sentence[i:i+max_length])
+                            current_chunk = ""
+                        else:
+                            current_chunk = sentence
+                if current_chunk:
+                    chunks.append(current_chunk)
+                current_chunk = ""
+            else:
+                current_chunk = paragraph
+    if current_chunk:
+        chunks.append(current_chunk)
+
+    return chunks
+
+def _random_document(rng, length):
+    """Random text dense in the separators the chunker cares about"""
+    alphabet = ["a", "b", " ", ".", ". ", "\n", "\n\n", "\n\n\n", "word ", "Sentence. "]
+    weights = [20, 10, 15, 3, 6, 3, 4, 1, 10, 6]
+    parts = []
+    size = 0
+    while size < length:
+        token = rng.choices(alphabet, weights)[0]
+        if rng.random() < 0.01:
+            token = "x" * rng.randint(1, length)
+        parts.append(token)
+        size += len(token)
+    return "".join(parts)[:length]
+
+@pytest.mark.parametrize("seed", range(4))
+def test_split_dom_content_matches_legacy(seed, cases=500):
+    rng = random.Random(seed)
+    for case in range(cases):
+        max_length = rng.randint(1, 200)
+        document = _random_document(rng, rng.randint(0, max_length * 8))
+        assert split_dom_content(document, max_length) == legacy_split_dom_content(document, max_length), \
+            f"case {case} (max_length={max_length}): {document!r}"
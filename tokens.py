@@ -0,0 +1,65 @@
+import logging
+import math
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Average characters per token for English news text, used when no tokenizer is installed
+APPROX_CHARS_PER_TOKEN = 4.0
+
+# Use a real BPE tokenizer when tiktoken is installed; cl100k_base is close to the Llama 3 vocabulary
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+def count_tokens(text):
+    """Count tokens in text with tiktoken, or estimate them from the character count"""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text) / APPROX_CHARS_PER_TOKEN)
+
+def truncate_to_tokens(text, max_tokens):
+    """Return the longest prefix of text that is at most max_tokens tokens"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[:max(0, max_tokens)])
+    return text[:int(max(0, max_tokens) * APPROX_CHARS_PER_TOKEN)]
+
+def pack_by_tokens(text, max_tokens, split_chars, safety_margin=0.95):
+    """Split text into chunks of at most max_tokens tokens, each packed as full as possible
+
+    split_chars(text, max_chars) is the character-based chunker (e.g. scrape.iter_dom_chunks).
+    The character limit starts from the text's own chars-per-token ratio, and any chunk that
+    still exceeds the token budget is re-split with a proportionally smaller limit.
+    """
+    if max_tokens <= 0:
+        raise ValueError(f"Token budget must be positive, got {max_tokens}")
+
+    total_tokens = count_tokens(text)
+    if total_tokens <= max_tokens:
+        return [text]
+
+    chars_per_token = len(text) / total_tokens
+    max_chars = max(1, int(max_tokens * chars_per_token * safety_margin))
+
+    chunks = []
+    pending = list(split_chars(text, max_chars))
+    pending.reverse()
+    while pending:
+        chunk = pending.pop()
+        chunk_tokens = count_tokens(chunk)
+        if chunk_tokens <= max_tokens or len(chunk) <= 1:
+            chunks.append(chunk)
+            continue
+        # Token-dense chunk (numbers, tickers, non-English text): split it again more tightly
+        smaller = max(1, min(len(chunk) - 1, int(len(chunk) * max_tokens / chunk_tokens * safety_margin)))
+        pending.extend(reversed(list(split_chars(chunk, smaller))))
+
+    logger.info(f"Packed {total_tokens} tokens into {len(chunks)} chunks of at most {max_tokens} tokens")
+    return chunks